@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Atomic file writes for generated pages.
+Text is streamed to a temporary file in the destination directory and renamed
+over the destination only once complete, so a crash or error mid-build never
+leaves a half-written page behind.
+"""
+import hashlib
+import os
+import tempfile
+
+# Hex digits of the SHA-256 in a name from hashed_name()
+HASHED_NAME_LENGTH = 16
+
+def write_temp(path, fragments, binary=False, durable=False):
+    """Write an iterable of text (or, if binary, bytes) fragments to a temporary file beside path and return its name.
+
+    With durable, the data is flushed to disk before returning.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix=os.path.splitext(path)[1])
+    try:
+        with (os.fdopen(fd, 'wb') if binary else os.fdopen(fd, 'w', encoding='utf-8')) as f:
+            for fragment in fragments:
+                f.write(fragment)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        # mkstemp creates the file private; deployed pages need to be world-readable
+        os.chmod(temp_path, 0o644)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path
+
+def hashed_name(text, extension):
+    """A file name made from a hash of text, for files that are never served stale because they never change"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:HASHED_NAME_LENGTH] + extension
+
+def fsync_directory(path):
+    """Flush a directory entry change (a rename or delete) in the directory containing path to disk"""
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def write_atomic(path, fragments, binary=False, durable=False):
+    """Stream fragments to path, replacing it only once everything was written.
+
+    With durable, both the new contents and the rename are on disk before returning.
+    """
+    os.replace(write_temp(path, fragments, binary, durable), path)
+    if durable:
+        fsync_directory(path)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+The organized content order (content_order.json), shared by organize_server.py,
+generate_final.py and sync_notes_to_order.py.
+Edits are operations applied through a Journal:
+    {"op": "insert", "item": {...}, "index": n}       add or update an item and put it at index n (default: the end)
+    {"op": "move", "filename": "...", "index": n}     move an item to index n
+    {"op": "remove", "filename": "..."}               take an item out of the order
+    {"op": "set_excluded", "filename": "...", "excluded": true}   mark an item DM-only (or not)
+Every operation states the result rather than a change, so replaying one twice is harmless.
+An operation naming a file that is not in the order (other than insert), or
+that is in it more than once, is rejected; the organizer then saves the whole
+order instead.
+"""
+from journal import Journal
+
+def find_item(items, filename):
+    """Return the index of the item for filename, or None if there is none.
+
+    Raises ValueError if several items share the filename, as an operation can't tell them apart.
+    """
+    found = [index for index, item in enumerate(items) if item.get('filename') == filename]
+    if len(found) > 1:
+        raise ValueError(f"{filename!r} is in the order {len(found)} times")
+    return found[0] if found else None
+
+def target_index(op, length):
+    index = op.get('index', length)
+    if not isinstance(index, int) or isinstance(index, bool):
+        raise ValueError(f"Invalid index: {index!r}")
+    return max(0, min(index, length))
+
+def apply_order_op(state, op):
+    """Apply one operation to {'items': [...]} in place, returning whether it changed anything"""
+    items = state.setdefault('items', [])
+    kind = op.get('op')
+
+    if kind == 'insert':
+        item = op.get('item')
+        if not isinstance(item, dict) or not item.get('filename'):
+            raise ValueError("insert needs an item with a filename")
+        current = find_item(items, item['filename'])
+        if current is not None:
+            if items[current] == item and current == target_index(op, len(items) - 1):
+                return False
+            del items[current]
+        items.insert(target_index(op, len(items)), dict(item))
+        return True
+
+    if kind in ('move', 'remove', 'set_excluded'):
+        current = find_item(items, op.get('filename'))
+        if current is None:
+            raise ValueError(f"Not in the order: {op.get('filename')!r}")
+        if kind == 'remove':
+            del items[current]
+            return True
+
+        if kind == 'move':
+            index = target_index(op, len(items) - 1)
+            if index == current:
+                return False
+            items.insert(index, items.pop(current))
+            return True
+
+        excluded = bool(op.get('excluded'))
+        if items[current].get('excluded', False) == excluded:
+            return False
+        items[current]['excluded'] = excluded
+        return True
+
+    raise ValueError(f"Unknown order operation: {kind!r}")
+
+def order_journal(path):
+    return Journal(path, apply_order_op, lambda: {'items': []})
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+In-memory cache of parsed documents for organize_server.py.
+Holds BeautifulSoup trees and metadata extracted from them (message lists,
+dates, note cards), keyed by file path and invalidated when a file's mtime or
+size changes. Least recently used entries are evicted to stay under a memory cap.
+The cache is safe to share between server threads.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from bs4 import BeautifulSoup
+
+from parsing import parse_file
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# A parsed tree takes roughly 13-18x the size of its source file in memory
+SOUP_BYTES_PER_BYTE = 16
+
+def estimate_size(value, file_size):
+    """Roughly estimate how many bytes a cached value keeps alive"""
+    if isinstance(value, BeautifulSoup):
+        return file_size * SOUP_BYTES_PER_BYTE
+    if isinstance(value, bytes):
+        return len(value)
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return file_size
+
+class DocumentCache:
+    """LRU cache of values derived from files, keyed by (path, kind)"""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, path, kind, build):
+        """Return build(path), reusing the cached result while the file's mtime and size are unchanged.
+
+        Values are shared between callers and must not be modified; copy a
+        cached soup before changing it. Building happens outside the lock, so
+        two threads missing on the same file at once may both build it.
+        """
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        key = (path, kind)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = build(path)
+        size = estimate_size(value, stat.st_size)
+        with self.lock:
+            self._discard(key)
+            if size <= self.max_bytes:
+                self.entries[key] = (version, value, size)
+                self.bytes += size
+                while self.bytes > self.max_bytes:
+                    self._discard(next(iter(self.entries)))
+                    self.evictions += 1
+        return value
+
+    def _discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def discard(self, key):
+        """Drop one cached entry"""
+        with self.lock:
+            self._discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Return entry count, memory use and hit/miss counters"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None
+            }
+
+def parse_html(path):
+    """Read and parse an HTML file"""
+    return parse_file(path)
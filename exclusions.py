@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Message-level exclusions (message_exclusions.json) as a lookup index.
+Shared by organize_server.py and generate_final.py: exclusions are held as
+{filename: frozenset of message dates}, so checking a card is a set lookup
+rather than a scan of the whole list. Changes are operations logged through a
+Journal, so a toggle appends one line instead of rewriting the file:
+    {"op": "add", "filename": "...", "date": "..."}
+    {"op": "remove", "filename": "...", "date": "..."}
+The index is rebuilt only when the file or its log changes on disk.
+"""
+import threading
+
+from journal import Journal
+
+def apply_exclusion_op(state, op):
+    """Apply one operation to {'exclusions': [...]} in place, returning whether it changed anything"""
+    kind = op.get('op')
+    if kind not in ('add', 'remove'):
+        raise ValueError(f"Unknown exclusion operation: {kind!r}")
+    filename, date = op.get('filename'), op.get('date')
+    if not isinstance(filename, str) or not isinstance(date, str):
+        raise ValueError("Exclusion operations need a filename and a date")
+
+    exclusions = state.setdefault('exclusions', [])
+    present = [i for i, e in enumerate(exclusions) if e['filename'] == filename and e['date'] == date]
+    if kind == 'add':
+        if present:
+            return False
+        exclusions.append({'filename': filename, 'date': date})
+        return True
+    for i in reversed(present):
+        del exclusions[i]
+    return bool(present)
+
+class ExclusionIndex:
+    """message_exclusions.json indexed by filename, reloaded when the file changes"""
+
+    def __init__(self, path):
+        self.journal = Journal(path, apply_exclusion_op, lambda: {'exclusions': []})
+        # (filename, date) pairs in file order, so saving keeps the list stable
+        self.pairs = {}
+        self.by_file = {}
+        self.version = None
+        self.lock = threading.RLock()
+
+    def refresh(self):
+        """Rebuild the index if the file or its log changed since it was last indexed"""
+        with self.lock:
+            state = self.journal.read()
+            if self.journal.version != self.version:
+                self.load(state.get('exclusions', []))
+                self.version = self.journal.version
+
+    def load(self, exclusions):
+        """Index a [{'filename', 'date'}] list"""
+        self.pairs = {(e['filename'], e['date']): None for e in exclusions}
+        by_file = {}
+        for filename, date in self.pairs:
+            by_file.setdefault(filename, set()).add(date)
+        self.by_file = {filename: frozenset(dates) for filename, dates in by_file.items()}
+
+    def dates(self, filename):
+        """Return the frozenset of excluded message dates for a file"""
+        self.refresh()
+        return self.by_file.get(filename, frozenset())
+
+    def exclusions(self):
+        """Return the exclusions as the [{'filename', 'date'}] list stored in the file"""
+        with self.lock:
+            self.refresh()
+            return [{'filename': filename, 'date': date} for filename, date in self.pairs]
+
+    def __len__(self):
+        self.refresh()
+        return len(self.pairs)
+
+    def apply(self, ops):
+        """Log a batch of add/remove operations, returning the ones that changed anything"""
+        with self.lock:
+            self.refresh()
+            changed = self.journal.apply(ops)
+            for op in changed:
+                self.update(op['filename'], op['date'], op['op'] == 'add')
+            self.version = self.journal.version
+            return changed
+
+    def update(self, filename, date, excluded):
+        """Apply one change to the index in place"""
+        dates = set(self.by_file.get(filename, ()))
+        if excluded:
+            self.pairs[(filename, date)] = None
+            dates.add(date)
+        else:
+            self.pairs.pop((filename, date), None)
+            dates.discard(date)
+        if dates:
+            self.by_file[filename] = frozenset(dates)
+        else:
+            self.by_file.pop(filename, None)
+
+    def replace(self, exclusions):
+        """Replace every exclusion with a [{'filename', 'date'}] list and save"""
+        with self.lock:
+            self.load(exclusions)
+            self.journal.replace({'exclusions': [{'filename': filename, 'date': date}
+                                                 for filename, date in self.pairs]})
+            self.version = self.journal.version
+
+    def compact(self):
+        """Fold the log into message_exclusions.json"""
+        self.journal.compact()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+On-disk cache of rendered chronicle sections for generate_final.py.
+Each section is stored under a hash of everything it is rendered from: the
+source file's contents, the messages excluded from it, the item title and the
+parser backend (lxml and html.parser can serialize a section differently).
+Unchanged sections are reused without parsing their source file again.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+from parsing import DEFAULT_BACKEND
+
+# Bump whenever section extraction changes so old fragments are not reused
+FRAGMENT_VERSION = 1
+
+class FragmentCache:
+    """Directory of <key>.json section fragments with per-build hit/rebuild counts"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.digests = {}
+        self.used = set()
+        self.hits = 0
+        self.rebuilt = []
+
+    def file_digest(self, filepath):
+        """Return the SHA-256 of a source file, hashing each file once per build"""
+        digest = self.digests.get(filepath)
+        if digest is None:
+            with open(filepath, 'rb') as f:
+                digest = self.digests[filepath] = hashlib.sha256(f.read()).hexdigest()
+        return digest
+
+    def key(self, filepath, item_filename, excluded_dates, title):
+        """Build the cache key for one section"""
+        parts = [FRAGMENT_VERSION, DEFAULT_BACKEND, item_filename, self.file_digest(filepath), sorted(excluded_dates), title]
+        return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+    def section(self, key, title, build):
+        """Return the cached (title, body) for key, or build, store and return it"""
+        self.used.add(key)
+        path = os.path.join(self.cache_dir, f'{key}.json')
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                content_title, content_body = json.load(f)
+            self.hits += 1
+            return content_title, content_body
+        except (OSError, ValueError):
+            pass
+
+        content_title, content_body = build()
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp-')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump([content_title, content_body], f)
+        os.replace(temp_path, path)
+        self.rebuilt.append(title)
+        return content_title, content_body
+
+    def load(self, key):
+        """Read back the (title, body) of a section stored earlier in this build"""
+        with open(os.path.join(self.cache_dir, f'{key}.json'), 'r', encoding='utf-8') as f:
+            content_title, content_body = json.load(f)
+        return content_title, content_body
+
+    def prune(self):
+        """Delete fragments no section used in this build, returning how many were removed"""
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json') and name[:-5] not in self.used:
+                os.remove(os.path.join(self.cache_dir, name))
+                removed += 1
+        return removed
+
+    def report(self):
+        """Print which sections came from the cache and which were rebuilt"""
+        print(f"Sections: {self.hits} from cache, {len(self.rebuilt)} rebuilt")
+        for title in self.rebuilt:
+            print(f"  rebuilt: {title}")
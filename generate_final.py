@@ -4,49 +4,94 @@ Generate final deployment from saved content order.
 Creates a single combined HTML file with all content in the specified order.
 """
 import os
-import json
+import re
+import copy
 import shutil
+import argparse
 from pathlib import Path
-from bs4 import BeautifulSoup
+from parsing import parse
+from image_store import BLOB_RE
+from optimize_images import HTML_COMMENT_RE, optimize_images, rewrite_img_tags
+from fragment_cache import FragmentCache
+from exclusions import ExclusionIndex
+from content_order import order_journal
+from atomic_write import hashed_name, write_temp, write_atomic
+from precompress import precompress_deployment
+from search_index import MAX_RESULTS, PHRASE_BONUS, write_search_index
+from scrub_pii import PII_CONFIG_FILE, PIIScrubber, load_name_replacements, scrub_fragments
 
 OUTPUT_DIR = 'cleaned_emails'
 ORDER_FILE = 'content_order.json'
 MESSAGE_EXCLUSIONS_FILE = 'message_exclusions.json'
 FINAL_OUTPUT_DIR = 'public'
 FINAL_HTML = os.path.join(FINAL_OUTPUT_DIR, 'index.html')
+SOURCE_IMAGES_DIR = os.path.join(OUTPUT_DIR, 'images')
+FINAL_IMAGES_DIR = os.path.join(FINAL_OUTPUT_DIR, 'images')
+SECTIONS_DIR = os.path.join(FINAL_OUTPUT_DIR, 'sections')
+IMAGE_VARIANTS_DIR = os.path.join(OUTPUT_DIR, '.cache', 'images')
+FRAGMENTS_DIR = os.path.join(OUTPUT_DIR, '.cache', 'fragments')
+PRECOMPRESS_MANIFEST = os.path.join(OUTPUT_DIR, '.cache', 'precompress.json')
+SEARCH_CACHE = os.path.join(OUTPUT_DIR, '.cache', 'search.json')
+
+IMAGE_ATTR_RE = re.compile(r'\s(?:src|srcset)="([^"]*)"')
+IMAGE_REF_RE = re.compile(r'(?<![\w/])images/([\w.-]+)')
 
 def load_order():
-    """Load the saved content order"""
-    if not os.path.exists(ORDER_FILE):
+    """Load the saved content order, including edits the organizer has logged but not compacted yet"""
+    journal = order_journal(ORDER_FILE)
+    if not journal.exists():
         print(f"Error: {ORDER_FILE} not found. Please organize content first.")
         return None
 
-    with open(ORDER_FILE, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-        return data.get('items', [])
-
-def load_message_exclusions():
-    """Load message-level exclusions"""
-    if not os.path.exists(MESSAGE_EXCLUSIONS_FILE):
-        return []
-
-    with open(MESSAGE_EXCLUSIONS_FILE, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-        return data.get('exclusions', [])
-
-def extract_player_note(filepath, note_id, title):
+    return journal.read().get('items', [])
+
+class SourceDocument:
+    """A source file parsed once per build, with its divs indexed by id"""
+
+    def __init__(self, filepath):
+        with open(filepath, 'r', encoding='utf-8') as f:
+            self.content = f.read()
+        self.filepath = filepath
+        self.soup = parse(self.content)
+
+        # First div with each id, as soup.find('div', id=...) would return
+        self.divs_by_id = {}
+        for div in self.soup.find_all('div', id=True):
+            self.divs_by_id.setdefault(div['id'], div)
+
+        # (title, body) once the thread has been extracted
+        self.thread = None
+
+def load_source(documents, filepath):
+    """Return the parsed document for filepath, parsing it the first time it is needed"""
+    document = documents.get(filepath)
+    if document is None:
+        document = documents[filepath] = SourceDocument(filepath)
+    return document
+
+def index_cards_by_date(container):
+    """Map each message card's header date to the cards carrying it"""
+    cards_by_date = {}
+    for card in container.find_all('div', class_='card'):
+        header = card.find('div', class_='card-header')
+        if header:
+            date_elem = header.find('small')
+            if date_elem:
+                cards_by_date.setdefault(date_elem.get_text(strip=True), []).append(card)
+    return cards_by_date
+
+def extract_player_note(document, note_id, title):
     """Extract a specific note from player_notes.html"""
-    with open(filepath, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    soup = BeautifulSoup(content, 'html.parser')
-
     # Find the note by ID
-    note_content = soup.find('div', id=note_id)
+    note_content = document.divs_by_id.get(note_id)
     if note_content:
         # Get the parent card to include the header
         note_card = note_content.find_parent('div', class_='note')
         if note_card:
+            # Edit a copy so the shared parse stays intact for the other notes
+            note_card = copy.copy(note_card)
+            note_content = note_card.find('div', id=note_id)
+
             # Remove the onclick and styling that's for the collapsible interface
             header = note_card.find('div', class_='card-header')
             if header:
@@ -63,15 +108,18 @@ def extract_player_note(filepath, note_id, title):
 
     return title, f'<p>Note not found: {note_id}</p>'
 
-def extract_body_content(filepath, message_exclusions, filename):
+def extract_body_content(document, exclusions, filename):
     """Extract the main content from an HTML file, filtering out excluded messages"""
-    with open(filepath, 'r', encoding='utf-8') as f:
-        content = f.read()
+    # The extraction edits the parse, so do it once and reuse it if the file is listed again
+    if document.thread is None:
+        document.thread = extract_thread(document, exclusions, filename)
+    return document.thread
 
-    soup = BeautifulSoup(content, 'html.parser')
+def extract_thread(document, exclusions, filename):
+    soup = document.soup
 
-    # Get list of excluded dates for this file
-    excluded_dates = [e['date'] for e in message_exclusions if e['filename'] == filename]
+    # Get the excluded dates for this file
+    excluded_dates = exclusions.dates(filename)
 
     # Try to find the main content section
     main_content = soup.find('section', class_='story-thread')
@@ -85,18 +133,13 @@ def extract_body_content(filepath, message_exclusions, filename):
             title_elem.decompose()
 
         # Filter out excluded messages
-        cards = main_content.find_all('div', class_='card')
         removed_count = 0
-        for card in cards:
-            # Check if this message's date is in the exclusion list
-            header = card.find('div', class_='card-header')
-            if header:
-                date_elem = header.find('small')
-                if date_elem:
-                    message_date = date_elem.get_text(strip=True)
-                    if message_date in excluded_dates:
-                        card.decompose()
-                        removed_count += 1
+        if excluded_dates:
+            cards_by_date = index_cards_by_date(main_content)
+            for message_date in excluded_dates:
+                for card in cards_by_date.get(message_date, []):
+                    card.decompose()
+                    removed_count += 1
 
         if removed_count > 0:
             print(f"  Excluded {removed_count} message(s) from '{title}'")
@@ -106,40 +149,63 @@ def extract_body_content(filepath, message_exclusions, filename):
     # Fallback: get body content
     body = soup.find('body')
     if body:
-        return os.path.basename(filepath).replace('.html', '').replace('_', ' '), str(body)
-
-    return 'Untitled', content
-
-def generate_combined_html(ordered_items):
-    """Generate a single HTML file with all content in order"""
-    os.makedirs(FINAL_OUTPUT_DIR, exist_ok=True)
-
-    # Load message exclusions
-    message_exclusions = load_message_exclusions()
-    if message_exclusions:
-        print(f"Loaded {len(message_exclusions)} message-level exclusion(s)")
-
-    # Filter out excluded items (DM only)
-    excluded_count = sum(1 for item in ordered_items if item.get('excluded', False))
-    ordered_items = [item for item in ordered_items if not item.get('excluded', False)]
-
-    if excluded_count > 0:
-        print(f"Excluding {excluded_count} DM-only thread(s) from player deployment")
-
-    # Copy images directory
-    source_images = os.path.join(OUTPUT_DIR, 'images')
-    dest_images = os.path.join(FINAL_OUTPUT_DIR, 'images')
-    if os.path.exists(source_images):
-        if os.path.exists(dest_images):
-            shutil.rmtree(dest_images)
-        shutil.copytree(source_images, dest_images)
-        print(f"Copied {len(os.listdir(source_images))} images to {dest_images}")
-
-    # Start building the combined HTML
-    html_parts = []
-
-    # Header
-    html_parts.append('''<!DOCTYPE html>
+        return os.path.basename(document.filepath).replace('.html', '').replace('_', ' '), str(body)
+
+    return 'Untitled', document.content
+
+def referenced_images(html):
+    """Return the names of all images/ files the src and srcset attributes in html point at, outside comments"""
+    names = set()
+    for value in IMAGE_ATTR_RE.findall(HTML_COMMENT_RE.sub('', html)):
+        names.update(IMAGE_REF_RE.findall(value))
+    return names
+
+def make_readable(path):
+    """Let the web server read a deployed image; blobs stored by older runs were private"""
+    mode = os.stat(path).st_mode & 0o777
+    if mode & 0o044 != 0o044:
+        os.chmod(path, mode | 0o044)
+
+def sync_images(wanted):
+    """Link or copy each wanted image into the deployment exactly once.
+
+    Images are content-addressed, so an image already deployed under the same
+    name is unchanged and skipped. Images nothing references any more are removed.
+    """
+    os.makedirs(FINAL_IMAGES_DIR, exist_ok=True)
+    added = 0
+    missing = 0
+    for name in sorted(wanted):
+        source = os.path.join(SOURCE_IMAGES_DIR, name)
+        if not os.path.exists(source):
+            source = os.path.join(IMAGE_VARIANTS_DIR, name)
+        dest = os.path.join(FINAL_IMAGES_DIR, name)
+        if not os.path.exists(source):
+            missing += 1
+            continue
+        if os.path.exists(dest):
+            if BLOB_RE.match(name) or os.path.samefile(source, dest):
+                make_readable(dest)
+                continue
+            os.remove(dest)
+        try:
+            os.link(source, dest)
+        except OSError:
+            shutil.copy2(source, dest)
+        make_readable(dest)
+        added += 1
+
+    removed = 0
+    for name in os.listdir(FINAL_IMAGES_DIR):
+        if name not in wanted:
+            os.remove(os.path.join(FINAL_IMAGES_DIR, name))
+            removed += 1
+
+    print(f"Images: {len(wanted)} referenced, {added} added to {FINAL_IMAGES_DIR}, {removed} removed")
+    if missing:
+        print(f"Warning: {missing} referenced image(s) not found in {SOURCE_IMAGES_DIR}")
+
+PAGE_HEADER = '''<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
@@ -232,6 +298,37 @@ def generate_combined_html(ordered_items):
             font-weight: bold;
             margin-right: 0.5rem;
         }
+        .search {
+            margin-bottom: 2rem;
+        }
+        .search input {
+            border-radius: 15px;
+            padding: 0.75rem 1.25rem;
+            font-size: 1.1rem;
+        }
+        .search ul {
+            list-style: none;
+            padding: 0 2rem;
+            margin: 0;
+            background: rgba(255, 255, 255, 0.95);
+            border-radius: 0 0 15px 15px;
+        }
+        .search li {
+            padding: 0.5rem 0;
+            border-bottom: 1px solid rgba(0,0,0,0.1);
+        }
+        .search li:last-child {
+            border-bottom: none;
+        }
+        .search a {
+            color: #dc3545;
+            text-decoration: none;
+            font-weight: 500;
+        }
+        .search small {
+            color: #6c757d;
+            margin-left: 0.5rem;
+        }
         .footer {
             text-align: center;
             color: #fff;
@@ -247,103 +344,411 @@ def generate_combined_html(ordered_items):
             <p>Campaign Chronicle</p>
         </div>
 
+        <div class="search">
+            <input type="search" id="search-input" class="form-control" placeholder="🔍 Search the chronicle..."
+                   autocomplete="off" aria-label="Search the chronicle">
+            <ul id="search-results"></ul>
+        </div>
+
         <div class="toc">
             <h2>📜 Table of Contents</h2>
             <ul>
-''')
+'''
+
+TOC_FOOTER = '''            </ul>
+        </div>
+
+'''
+
+PAGE_FOOTER = '''        <div class="footer">
+            <p>Campaign Chronicle • Generated from Email Archives</p>
+        </div>
+    </div>
+</body>
+</html>
+'''
+
+# Split mode: sections live in sections/<hash>.html and are fetched when scrolled near or linked to
+SECTION_FILE_HEADER = '''<!DOCTYPE html>
+<meta charset="UTF-8">
+<base href="../">
+'''
+
+SECTION_LOADER = '''        <script>
+        (function () {
+            var loading = {};
+            function load(src) {
+                if (!loading[src]) {
+                    loading[src] = fetch(src).then(function (response) {
+                        if (!response.ok) throw new Error(response.status);
+                        return response.text();
+                    }).then(function (html) {
+                        var doc = new DOMParser().parseFromString(html, 'text/html');
+                        doc.querySelectorAll('.content-section').forEach(function (section) {
+                            var placeholder = document.getElementById(section.id);
+                            if (placeholder) placeholder.replaceWith(document.importNode(section, true));
+                        });
+                    }).catch(function () {
+                        delete loading[src];
+                    });
+                }
+                return loading[src];
+            }
+            function show(id) {
+                var section = id && document.getElementById(id);
+                if (section && section.dataset.src) {
+                    load(section.dataset.src).then(function () {
+                        document.getElementById(id).scrollIntoView();
+                    });
+                }
+            }
+            var observer = new IntersectionObserver(function (entries) {
+                entries.forEach(function (entry) {
+                    if (entry.isIntersecting) load(entry.target.dataset.src);
+                });
+            }, {rootMargin: '1500px 0px'});
+            document.querySelectorAll('.content-section[data-src]').forEach(function (section) {
+                observer.observe(section);
+            });
+            window.addEventListener('hashchange', function () { show(location.hash.slice(1)); });
+            show(location.hash.slice(1));
+        })();
+        </script>
+
+'''
+
+# Search box: loads search-index.json (see search_index.py) on first use and mirrors search_index.search()
+SEARCH_SCRIPT = '''        <script>
+        (function () {
+            var input = document.getElementById('search-input');
+            var list = document.getElementById('search-results');
+            var index = null;
+            var loading = null;
+            function load() {
+                if (!loading) {
+                    loading = fetch('search-index.json').then(function (response) {
+                        if (!response.ok) throw new Error(response.status);
+                        return response.json();
+                    }).then(function (data) {
+                        index = data;
+                    }).catch(function () {
+                        loading = null;
+                    });
+                }
+                return loading;
+            }
+            function tokenize(text) {
+                return text.normalize('NFC').toLowerCase().match(/[\\p{L}\\p{M}\\p{N}_]+/gu) || [];
+            }
+            function lowerBound(word) {
+                var low = 0, high = index.terms.length;
+                while (low < high) {
+                    var middle = (low + high) >> 1;
+                    if (index.terms[middle] < word) low = middle + 1; else high = middle;
+                }
+                return low;
+            }
+            function positionsByDoc(term, into) {
+                var postings = index.postings[term];
+                for (var i = 0; i < postings.length; i += 2 + postings[i + 1]) {
+                    var doc = postings[i], positions = into[doc] || (into[doc] = {}), position = 0;
+                    for (var j = 0; j < postings[i + 1]; j++) {
+                        position += postings[i + 2 + j];
+                        positions[position] = true;
+                    }
+                }
+            }
+            function search(query) {
+                var words = tokenize(query), matches = [];
+                for (var w = 0; w < words.length; w++) {
+                    // The word being typed matches as a prefix
+                    var start = lowerBound(words[w]), end = start, found = {};
+                    if (w === words.length - 1) {
+                        while (end < index.terms.length && index.terms[end].lastIndexOf(words[w], 0) === 0) end++;
+                    } else if (index.terms[start] === words[w]) {
+                        end = start + 1;
+                    }
+                    for (var term = start; term < end; term++) positionsByDoc(term, found);
+                    matches.push(found);
+                }
+                var hits = [];
+                if (!matches.length) return hits;
+                Object.keys(matches[0]).forEach(function (doc) {
+                    if (!matches.every(function (found) { return doc in found; })) return;
+                    var count = 0, score = 0;
+                    matches.forEach(function (found) { count += Object.keys(found[doc]).length; });
+                    score = count;
+                    if (matches.length > 1) {
+                        Object.keys(matches[0][doc]).forEach(function (position) {
+                            if (matches.every(function (found, offset) { return (+position + offset) in found[doc]; })) score += PHRASE_BONUS;
+                        });
+                    }
+                    hits.push({doc: +doc, score: score, count: count});
+                });
+                hits.sort(function (a, b) { return b.score - a.score || a.doc - b.doc; });
+                return hits.slice(0, MAX_RESULTS);
+            }
+            function show() {
+                list.textContent = '';
+                if (!index || !input.value.trim()) return;
+                var hits = search(input.value);
+                if (!hits.length) {
+                    var none = document.createElement('li');
+                    none.textContent = 'No matches';
+                    list.appendChild(none);
+                }
+                hits.forEach(function (hit) {
+                    var section = index.sections[hit.doc];
+                    var item = document.createElement('li');
+                    var link = document.createElement('a');
+                    var number = document.createElement('span');
+                    var count = document.createElement('small');
+                    link.href = '#' + section[0];
+                    number.className = 'section-number';
+                    number.textContent = section[1];
+                    link.appendChild(number);
+                    link.appendChild(document.createTextNode(section[2]));
+                    count.textContent = hit.count + (hit.count === 1 ? ' match' : ' matches');
+                    item.appendChild(link);
+                    item.appendChild(count);
+                    list.appendChild(item);
+                });
+            }
+            input.addEventListener('focus', load);
+            input.addEventListener('input', function () {
+                load().then(show);
+            });
+        })();
+        </script>
+
+'''.replace('PHRASE_BONUS', str(PHRASE_BONUS)).replace('MAX_RESULTS', str(MAX_RESULTS))
+
+def collect_sections(ordered_items, exclusions, fragments):
+    """Render (or reuse) the section of every item, returning (sections, referenced image names).
+
+    Each source file is parsed at most once, and only if one of its sections
+    isn't in the fragment cache. Section bodies are left in the cache rather
+    than kept in memory; sections only carry their title and cache key.
+    """
+    sections = []
+    image_names = set()
+    documents = {}
 
-    # Generate TOC and collect content
-    content_sections = []
     for idx, item in enumerate(ordered_items, 1):
         filename = item['filename']
         title = item['title']
 
-        # Add to TOC
-        section_id = f"section-{idx}"
-        html_parts.append(f'                <li><a href="#{section_id}"><span class="section-number">{idx}</span>{title}</a></li>\n')
-
         # Get content
         # Check if this is an individual player note
         if filename.startswith('player_notes.html#'):
             actual_file, note_id = filename.split('#', 1)
             filepath = actual_file
-            if os.path.exists(filepath):
-                content_title, content_body = extract_player_note(filepath, note_id, title)
-                content_sections.append({
-                    'id': section_id,
-                    'number': idx,
-                    'title': content_title,
-                    'body': content_body,
-                    'type': item['type']
-                })
-            else:
+            if not os.path.exists(filepath):
                 print(f"Warning: File not found: {filepath}")
+                continue
+            key = fragments.key(filepath, filename, (), title)
+            content_title, content_body = fragments.section(
+                key, title, lambda: extract_player_note(load_source(documents, filepath), note_id, title))
         elif filename == 'player_notes.html':
             # Legacy: handle old single player_notes item
             filepath = filename
-            if os.path.exists(filepath):
-                content_title, content_body = extract_body_content(filepath, message_exclusions, filename)
-                content_sections.append({
-                    'id': section_id,
-                    'number': idx,
-                    'title': content_title,
-                    'body': content_body,
-                    'type': item['type']
-                })
-            else:
+            if not os.path.exists(filepath):
                 print(f"Warning: File not found: {filepath}")
+                continue
+            key = fragments.key(filepath, filename, exclusions.dates(filename), title)
+            content_title, content_body = fragments.section(
+                key, title, lambda: extract_body_content(load_source(documents, filepath), exclusions, filename))
         else:
             # Regular email thread
             filepath = os.path.join(OUTPUT_DIR, filename)
-            if os.path.exists(filepath):
-                content_title, content_body = extract_body_content(filepath, message_exclusions, filename)
-                content_sections.append({
-                    'id': section_id,
-                    'number': idx,
-                    'title': content_title,
-                    'body': content_body,
-                    'type': item['type']
-                })
-            else:
+            if not os.path.exists(filepath):
                 print(f"Warning: File not found: {filepath}")
+                continue
+            key = fragments.key(filepath, filename, exclusions.dates(filename), title)
+            content_title, content_body = fragments.section(
+                key, title, lambda: extract_body_content(load_source(documents, filepath), exclusions, filename))
+            # Thread files are listed once, so don't keep their parse around
+            documents.pop(filepath, None)
+
+        image_names.update(referenced_images(content_body))
+        sections.append({
+            'id': f"section-{idx}",
+            'number': idx,
+            'title': content_title,
+            'key': key,
+            'type': item['type']
+        })
+
+    return sections, image_names
+
+def render_toc(ordered_items):
+    """Yield the page header and table of contents"""
+    yield PAGE_HEADER
+    for idx, item in enumerate(ordered_items, 1):
+        yield f'                <li><a href="#section-{idx}"><span class="section-number">{idx}</span>{item["title"]}</a></li>\n'
+    yield TOC_FOOTER
 
-    # Close TOC
-    html_parts.append('''            </ul>
+def render_section(section, body):
+    return f'''        <div class="content-section" id="{section['id']}">
+            <h2 class="section-title">
+                <span class="section-number">{section['number']}</span>
+                {section['title']}
+            </h2>
+            {body}
         </div>
 
-''')
-
-    # Add all content sections
-    for section in content_sections:
-        html_parts.append(f'''        <div class="content-section" id="{section['id']}">
+'''
+
+def load_section_body(section, fragments, manifests, deployed_images):
+    """Read a section's body back from the fragment cache, pointing its images at the deployed variants"""
+    _, content_body = fragments.load(section['key'])
+    content_body = rewrite_img_tags(content_body, manifests)
+    deployed_images.update(referenced_images(content_body))
+    return content_body
+
+def render_chronicle(ordered_items, sections, fragments, manifests, deployed_images):
+    """Yield the combined page piece by piece, reading section bodies back from the fragment cache one at a time.
+
+    Adds the name of every image the page references to deployed_images.
+    """
+    yield from render_toc(ordered_items)
+    for section in sections:
+        yield render_section(section, load_section_body(section, fragments, manifests, deployed_images))
+    yield SEARCH_SCRIPT
+    yield PAGE_FOOTER
+
+def write_section_files(sections, per_file, fragments, manifests, deployed_images, scrubber=None, scrub_mode='regex'):
+    """Write the sections, per_file to a file, to sections/<content hash>.html, returning {section id: file URL}.
+
+    Files are named after their contents so browsers never show a stale copy
+    of a section that changed.
+    """
+    os.makedirs(SECTIONS_DIR, exist_ok=True)
+    sources = {}
+    for start in range(0, len(sections), per_file):
+        group = sections[start:start + per_file]
+        parts = [SECTION_FILE_HEADER]
+        for section in group:
+            parts.append(render_section(section, load_section_body(section, fragments, manifests, deployed_images)))
+        if scrubber is not None:
+            parts = scrub_fragments(parts, scrubber, scrub_mode)
+        html = ''.join(parts)
+
+        name = hashed_name(html, '.html')
+        write_atomic(os.path.join(SECTIONS_DIR, name), [html])
+        for section in group:
+            sources[section['id']] = f'sections/{name}'
+    return sources
+
+def render_split_index(ordered_items, sections, sources):
+    """Yield the light index page: the table of contents and a placeholder per section that loads it on demand"""
+    yield from render_toc(ordered_items)
+    for section in sections:
+        src = sources[section['id']]
+        yield f'''        <div class="content-section" id="{section['id']}" data-src="{src}">
             <h2 class="section-title">
                 <span class="section-number">{section['number']}</span>
                 {section['title']}
             </h2>
-            {section['body']}
+            <p><a href="{src}">Loading…</a></p>
         </div>
 
-''')
+'''
+    yield SECTION_LOADER
+    yield SEARCH_SCRIPT
+    yield PAGE_FOOTER
 
-    # Footer
-    html_parts.append('''        <div class="footer">
-            <p>Campaign Chronicle • Generated from Email Archives</p>
-        </div>
-    </div>
-</body>
-</html>
-''')
+def prune_section_files(keep):
+    """Remove section files the current page no longer links to"""
+    if not os.path.isdir(SECTIONS_DIR):
+        return
+    for name in os.listdir(SECTIONS_DIR):
+        # Keep the .gz/.br copies of kept files too
+        if name not in keep and os.path.splitext(name)[0] not in keep:
+            os.remove(os.path.join(SECTIONS_DIR, name))
+
+def generate_combined_html(ordered_items, scrubber=None, scrub_mode='regex', sections_per_file=None):
+    """Generate the chronicle with all content in order, optionally scrubbing PII with a PIIScrubber as it is written.
+
+    By default everything goes into a single HTML file. With sections_per_file,
+    index.html only holds the table of contents and the sections are split
+    into files of that many sections each, fetched as the reader gets to them.
+    """
+    os.makedirs(FINAL_OUTPUT_DIR, exist_ok=True)
+
+    # Load message exclusions
+    exclusions = ExclusionIndex(MESSAGE_EXCLUSIONS_FILE)
+    if len(exclusions):
+        print(f"Loaded {len(exclusions)} message-level exclusion(s)")
 
-    # Write the final file
-    with open(FINAL_HTML, 'w', encoding='utf-8') as f:
-        f.write(''.join(html_parts))
+    # Filter out excluded items (DM only)
+    excluded_count = sum(1 for item in ordered_items if item.get('excluded', False))
+    ordered_items = [item for item in ordered_items if not item.get('excluded', False)]
+
+    if excluded_count > 0:
+        print(f"Excluding {excluded_count} DM-only thread(s) from player deployment")
+
+    # Render (or reuse) every section; bodies stay in the fragment cache until written
+    fragments = FragmentCache(FRAGMENTS_DIR)
+    sections, image_names = collect_sections(ordered_items, exclusions, fragments)
+    fragments.prune()
+    fragments.report()
+
+    # Swap in downscaled/WebP variants and lazy-load every image
+    manifests = optimize_images(image_names, SOURCE_IMAGES_DIR, IMAGE_VARIANTS_DIR)
+
+    # Stream the page to a temporary file, scrubbing PII on the way if asked
+    deployed_images = set()
+    sources = {}
+    if sections_per_file:
+        sources = write_section_files(sections, sections_per_file, fragments, manifests,
+                                      deployed_images, scrubber, scrub_mode)
+        page = render_split_index(ordered_items, sections, sources)
+    else:
+        page = render_chronicle(ordered_items, sections, fragments, manifests, deployed_images)
+    if scrubber is not None:
+        page = scrub_fragments(page, scrubber, scrub_mode)
+    temp_path = write_temp(FINAL_HTML, page)
+
+    # Bring over the images the page actually uses, then swap the page into place
+    try:
+        sync_images(deployed_images)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    os.replace(temp_path, FINAL_HTML)
+    prune_section_files({os.path.basename(src) for src in sources.values()})
+
+    # Index what was just written, so search never reveals text scrub_pii.py removed
+    write_search_index(FINAL_OUTPUT_DIR, SEARCH_CACHE)
+
+    # Compressed copies for GitLab Pages and the organizer server to serve
+    precompress_deployment(FINAL_OUTPUT_DIR, PRECOMPRESS_MANIFEST)
 
     print(f"\n✓ Generated {FINAL_HTML}")
-    print(f"✓ Combined {len(content_sections)} content sections")
+    if sections_per_file:
+        print(f"✓ Split {len(sections)} content sections across {len(set(sources.values()))} file(s) in {SECTIONS_DIR}")
+    else:
+        print(f"✓ Combined {len(sections)} content sections")
+    if scrubber is not None:
+        changes = scrubber.changes()
+        print(f"✓ Scrubbed PII ({scrub_mode} mode): " + ('; '.join(changes) if changes else 'none found'))
     print(f"\nDeployment ready in '{FINAL_OUTPUT_DIR}' directory!")
     print(f"To preview: cd {FINAL_OUTPUT_DIR} && python -m http.server 8080")
 
 def main():
+    parser = argparse.ArgumentParser(description='Generate the player-facing campaign chronicle.')
+    parser.add_argument('--scrub', action='store_true',
+                        help='scrub PII while writing the page, instead of running scrub_pii.py afterwards')
+    parser.add_argument('--scrub-mode', choices=['regex', 'dom'], default='regex',
+                        help="'regex' scrubs the raw HTML (default); 'dom' scrubs only text, comments and href/title/alt values")
+    parser.add_argument('--split', nargs='?', type=int, const=1, metavar='N',
+                        help='write a light index page and put the sections in separate files, N per file (default 1), '
+                             'loaded as the reader scrolls to them')
+    args = parser.parse_args()
+    if args.split is not None and args.split < 1:
+        parser.error('--split needs at least 1 section per file')
+
     print("Generating final deployment...\n")
 
     # Load the saved order
@@ -354,8 +759,13 @@ def main():
 
     print(f"Loaded order with {len(ordered_items)} items")
 
+    scrubber = None
+    if args.scrub:
+        print(f"Loading PII configuration from {PII_CONFIG_FILE}...")
+        scrubber = PIIScrubber(load_name_replacements())
+
     # Generate the combined HTML
-    generate_combined_html(ordered_items)
+    generate_combined_html(ordered_items, scrubber, args.scrub_mode, args.split)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Content-addressed store for images extracted from emails.
+Every distinct image is written exactly once, named by the SHA-256 of its
+bytes, and an index maps Content-IDs and attachment filenames to stored blobs.
+The index also maps a hash of each attachment's still-encoded payload to its
+blob (see encoded_key()), so a known attachment is never decoded again.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+from atomic_write import write_atomic
+
+INDEX_FILENAME = 'index.json'
+HASH_LENGTH = 32
+CHUNK_SIZE = 1024 * 1024
+# generate_final.py hard-links blobs into the deployment, so they must be world-readable
+BLOB_MODE = 0o644
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp']
+
+# Stored blobs are named <hash>.<ext>; anything else in the directory is legacy or temporary
+BLOB_RE = re.compile(r'^[0-9a-f]{%d}\.(?:jpg|jpeg|png|gif|webp)$' % HASH_LENGTH)
+
+def sniff_extension(head, default='.jpg'):
+    """Guess an image extension from its first bytes, falling back to default"""
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return '.png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return '.jpg'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return '.gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    return default
+
+def extension_from_name(name):
+    """Return the image extension of a filename or Content-ID, or None"""
+    if name:
+        ext = os.path.splitext(name.lower())[1]
+        if ext in IMAGE_EXTENSIONS:
+            return '.jpg' if ext == '.jpeg' else ext
+    return None
+
+def encoded_key(payload, transfer_encoding, default_ext):
+    """Key an attachment by its payload as it sits in the message, before any transfer decoding.
+
+    The extension it would be stored under if its bytes don't tell is part of
+    the key, so a hit always names the blob that decoding it would produce.
+    """
+    digest = hashlib.sha256(f'{transfer_encoding}\n{default_ext}\n'.encode('utf-8'))
+    for offset in range(0, len(payload), CHUNK_SIZE):
+        # Payloads are ASCII unless the message is broken; hash whatever is there
+        digest.update(payload[offset:offset + CHUNK_SIZE].encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()[:HASH_LENGTH]
+
+class BlobWriter:
+    """Streams image bytes to a temporary file while hashing them, then commits by hash"""
+
+    def __init__(self, store, default_ext='.jpg'):
+        self.store = store
+        self.default_ext = default_ext
+        self.digest = hashlib.sha256()
+        self.head = b''
+        self.size = 0
+        fd, self.temp_path = tempfile.mkstemp(dir=store.images_dir, prefix='.tmp-')
+        self.file = os.fdopen(fd, 'wb')
+
+    def write(self, chunk):
+        if len(self.head) < 16:
+            self.head += bytes(chunk[:16 - len(self.head)])
+        self.digest.update(chunk)
+        self.file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        """Move the blob into place (unless an identical one exists) and return its filename"""
+        self.file.close()
+        if self.size == 0:
+            os.remove(self.temp_path)
+            return None
+
+        blob = self.digest.hexdigest()[:HASH_LENGTH] + sniff_extension(self.head, self.default_ext)
+        blob_path = os.path.join(self.store.images_dir, blob)
+        if os.path.exists(blob_path):
+            os.remove(self.temp_path)
+        else:
+            # mkstemp creates the file private
+            os.chmod(self.temp_path, BLOB_MODE)
+            os.replace(self.temp_path, blob_path)
+        return blob
+
+    def discard(self):
+        """Throw the partially written blob away"""
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+class ImageStore:
+    """Directory of hash-named image blobs plus a Content-ID/filename index"""
+
+    def __init__(self, images_dir):
+        self.images_dir = images_dir
+        self.index_path = os.path.join(images_dir, INDEX_FILENAME)
+        self._index = None
+
+    def open_blob(self, default_ext='.jpg'):
+        """Start writing a new blob; call commit() or discard() on the returned writer"""
+        return BlobWriter(self, default_ext)
+
+    def put(self, data, default_ext='.jpg'):
+        """Store image bytes and return the blob filename"""
+        writer = self.open_blob(default_ext)
+        try:
+            view = memoryview(data)
+            for offset in range(0, len(view), CHUNK_SIZE):
+                writer.write(view[offset:offset + CHUNK_SIZE])
+        except BaseException:
+            writer.discard()
+            raise
+        return writer.commit()
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = {'cids': {}, 'filenames': {}, 'encoded': {}}
+            if os.path.exists(self.index_path):
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    self._index.update(json.load(f))
+        return self._index
+
+    def known_blob(self, key):
+        """Return the stored blob for an encoded_key(), or None if it was never stored (or was deleted)"""
+        blob = self.index['encoded'].get(key)
+        if blob and os.path.exists(os.path.join(self.images_dir, blob)):
+            return blob
+        return None
+
+    def record(self, refs):
+        """Merge {'cids': {cid: blob}, 'filenames': {filename: blob}, 'encoded': {key: blob}} references into the index"""
+        self.index['cids'].update(refs.get('cids', {}))
+        self.index['encoded'].update(refs.get('encoded', {}))
+        for filename, blob in refs.get('filenames', {}).items():
+            blobs = self.index['filenames'].setdefault(filename, [])
+            if blob not in blobs:
+                blobs.append(blob)
+
+    def save_index(self):
+        """Write the index atomically"""
+        if self._index is None:
+            return
+        write_atomic(self.index_path, [json.dumps(self._index, indent=2, sort_keys=True)])
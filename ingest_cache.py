@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Persistent cache and on-disk spool for clean_emails.py.
+Stores each cleaned message keyed by a hash of its raw bytes so re-runs only
+decode and clean new messages, and only rewrite thread files that changed.
+Messages are spooled to disk as they are cleaned, so memory use does not grow
+with the size of the archive; threading only reads their headers back.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+from datetime import datetime
+
+# Bump whenever the tables below change shape
+SCHEMA_VERSION = 3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    key TEXT PRIMARY KEY,
+    message_id TEXT,
+    subject TEXT,
+    parents TEXT,
+    date TEXT,
+    date_parsed TEXT,
+    body TEXT,
+    images TEXT,
+    files TEXT
+);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS source_messages (
+    path TEXT,
+    seq INTEGER,
+    key TEXT,
+    PRIMARY KEY (path, seq)
+);
+CREATE TABLE IF NOT EXISTS threads (
+    filename TEXT PRIMARY KEY,
+    digest TEXT
+);
+'''
+
+# Per-run spool of message keys in the order they were read, kept in SQLite's temp store
+SPOOL_SCHEMA = '''
+CREATE TEMP TABLE spool (
+    seq INTEGER PRIMARY KEY,
+    key TEXT
+);
+'''
+
+TABLES = ['meta', 'messages', 'sources', 'source_messages', 'threads']
+
+class IngestCache:
+    """SQLite-backed cache of cleaned messages, source files and written thread files"""
+
+    def __init__(self, path, version, temporary=False):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.temporary = temporary
+        self.conn = sqlite3.connect(path)
+
+        # Throw away everything cleaned by a different cleaner or stored in an older layout
+        version = f'{SCHEMA_VERSION}.{version}'
+        try:
+            row = self.conn.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        if row is None or row[0] != version:
+            with self.conn:
+                for table in TABLES:
+                    self.conn.execute(f'DROP TABLE IF EXISTS {table}')
+        self.conn.executescript(SCHEMA)
+        self.conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('version', ?)", (version,))
+        self.conn.executescript(SPOOL_SCHEMA)
+        self.conn.commit()
+
+    @classmethod
+    def temporary_cache(cls, version):
+        """Create a throwaway cache that is deleted on close (used for --no-cache runs)"""
+        fd, path = tempfile.mkstemp(prefix='ingest-', suffix='.sqlite')
+        os.close(fd)
+        return cls(path, version, temporary=True)
+
+    def lookup(self, key):
+        """Return (subject, referenced image files) for a cached message key, or None"""
+        row = self.conn.execute('SELECT subject, files FROM messages WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def put_message(self, key, subject, record, files):
+        """Store a cleaned message record and the image files its body references"""
+        date_parsed = record['date_parsed']
+        self.conn.execute(
+            'INSERT OR REPLACE INTO messages (key, message_id, subject, parents, date, date_parsed, body, images, files) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                key,
+                record['message_id'],
+                subject,
+                json.dumps(record.get('parents', [])),
+                str(record['date']) if record['date'] is not None else None,
+                date_parsed.isoformat() if date_parsed else None,
+                record['body'],
+                json.dumps(record.get('images', {})),
+                json.dumps(files)
+            )
+        )
+
+    def load_messages(self, keys):
+        """Return the cached records for a list of message keys, in the same order"""
+        records = {}
+        unique = list(dict.fromkeys(keys))
+        for i in range(0, len(unique), 500):
+            chunk = unique[i:i + 500]
+            rows = self.conn.execute(
+                f'SELECT key, message_id, date, date_parsed, body, images FROM messages '
+                f'WHERE key IN ({",".join("?" * len(chunk))})',
+                chunk
+            )
+            for key, message_id, date, date_parsed, body, images in rows:
+                records[key] = {
+                    'message_id': message_id,
+                    'date': date,
+                    'date_parsed': datetime.fromisoformat(date_parsed) if date_parsed else None,
+                    'body': body,
+                    'images': json.loads(images)
+                }
+        return [records[key] for key in keys]
+
+    def get_source(self, path):
+        """Yield the message keys recorded for a source file, or return None if it changed since"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        row = self.conn.execute('SELECT size, mtime_ns FROM sources WHERE path = ?', (path,)).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            return None
+        rows = self.conn.cursor().execute('SELECT key FROM source_messages WHERE path = ? ORDER BY seq', (path,))
+        return (key for (key,) in rows)
+
+    def start_source(self, path):
+        """Forget what a source file produced before it is re-read"""
+        self.conn.execute('DELETE FROM sources WHERE path = ?', (path,))
+        self.conn.execute('DELETE FROM source_messages WHERE path = ?', (path,))
+
+    def add_source_message(self, path, seq, key):
+        """Record the key of the seq-th message in a source file"""
+        self.conn.execute('INSERT OR REPLACE INTO source_messages (path, seq, key) VALUES (?, ?, ?)', (path, seq, key))
+
+    def finish_source(self, path):
+        """Mark a source file as fully read at its current size and mtime"""
+        stat = os.stat(path)
+        self.conn.execute(
+            'INSERT OR REPLACE INTO sources (path, size, mtime_ns) VALUES (?, ?, ?)',
+            (path, stat.st_size, stat.st_mtime_ns)
+        )
+        self.conn.commit()
+
+    def spool_add(self, key):
+        """Append a message to this run's spool"""
+        self.conn.execute('INSERT INTO spool (key) VALUES (?)', (key,))
+
+    def spool_mark(self):
+        """Return a position in the spool that spool_rollback can return to"""
+        return self.conn.execute('SELECT COALESCE(MAX(seq), 0) FROM spool').fetchone()[0]
+
+    def spool_rollback(self, mark):
+        """Drop every spooled message added after mark"""
+        self.conn.execute('DELETE FROM spool WHERE seq > ?', (mark,))
+
+    def spool_headers(self):
+        """Return [(key, message_id, parents, subject, date, date_parsed)] for the spooled messages in the order they were added"""
+        rows = self.conn.execute(
+            'SELECT spool.key, messages.message_id, messages.parents, messages.subject, messages.date, messages.date_parsed '
+            'FROM spool JOIN messages ON messages.key = spool.key ORDER BY spool.seq'
+        )
+        return [(key, message_id, json.loads(parents), subject, date,
+                 datetime.fromisoformat(date_parsed) if date_parsed else None)
+                for key, message_id, parents, subject, date, date_parsed in rows]
+
+    def thread_unchanged(self, filename, digest):
+        """Check whether a thread file was last written with this digest"""
+        row = self.conn.execute('SELECT digest FROM threads WHERE filename = ?', (filename,)).fetchone()
+        return row is not None and row[0] == digest
+
+    def thread_files(self):
+        """Return the filenames of every thread file recorded by put_thread()"""
+        return [filename for (filename,) in self.conn.execute('SELECT filename FROM threads')]
+
+    def put_thread(self, filename, digest):
+        """Record the digest a thread file was written with"""
+        self.conn.execute('INSERT OR REPLACE INTO threads (filename, digest) VALUES (?, ?)', (filename, digest))
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+        if self.temporary:
+            os.remove(self.path)
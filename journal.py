@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+JSON documents saved as a write-ahead log of small operations.
+Instead of rewriting content_order.json or message_exclusions.json on every
+click, organize_server.py appends each change to <file>.wal (one JSON line,
+fsynced) and only rewrites the JSON file when compacting. Compaction happens
+every COMPACT_AFTER_OPS operations and on shutdown, with fsync and an atomic
+rename. Readers such as generate_final.py load the JSON file and replay the
+log on top, so they always see the latest state.
+
+The log's first line records a hash of the JSON file it applies to. If the
+file was replaced after the log was started (a compaction interrupted before
+the log was removed, or an edit by hand), the log is ignored.
+"""
+import copy
+import hashlib
+import json
+import os
+import threading
+
+from atomic_write import fsync_directory, write_atomic
+
+WAL_SUFFIX = '.wal'
+COMPACT_AFTER_OPS = 100
+
+def file_version(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+class Journal:
+    """A JSON document, a log of operations applied since it was written, and their combined state"""
+
+    def __init__(self, path, apply_op, empty):
+        """apply_op(state, op) applies one operation in place, returning whether it changed anything,
+        and raises ValueError for an invalid operation. empty() builds a new document."""
+        self.path = path
+        self.wal_path = path + WAL_SUFFIX
+        self.apply_op = apply_op
+        self.empty = empty
+        self.lock = threading.RLock()
+        self.state = None
+        self.base = None
+        self.logged = 0
+        # Whether the log on disk is ours to append to
+        self.wal_valid = False
+        self.version = None
+
+    def exists(self):
+        return os.path.exists(self.path) or os.path.exists(self.wal_path)
+
+    def current_version(self):
+        return (file_version(self.path), file_version(self.wal_path))
+
+    def load(self):
+        """Read the JSON file and replay the log on top of it"""
+        try:
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            state, base = self.empty(), None
+        else:
+            state, base = json.loads(raw), hashlib.sha256(raw).hexdigest()
+
+        try:
+            with open(self.wal_path, 'rb') as f:
+                lines = f.read().split(b'\n')
+        except FileNotFoundError:
+            lines = []
+
+        logged = 0
+        wal_valid = False
+        if lines and lines[0]:
+            try:
+                header = json.loads(lines[0])
+            except ValueError:
+                header = None
+            if isinstance(header, dict) and header.get('base') == base:
+                wal_valid = True
+                for line in lines[1:]:
+                    if not line:
+                        continue
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        # A write cut short by a crash; compact before logging anything else
+                        wal_valid = False
+                        break
+                    try:
+                        self.apply_op(state, op)
+                    except (ValueError, KeyError, TypeError):
+                        # Only valid operations are logged, but don't let one bad line lose the rest
+                        pass
+                    logged += 1
+
+        self.state = state
+        self.base = base
+        self.logged = logged
+        self.wal_valid = wal_valid
+        self.version = self.current_version()
+
+    def refresh(self):
+        """Reload if the file or its log changed on disk since they were last read or written"""
+        with self.lock:
+            if self.state is None or self.current_version() != self.version:
+                self.load()
+
+    def read(self):
+        """Return the current document; callers must not modify it"""
+        with self.lock:
+            self.refresh()
+            return self.state
+
+    def apply(self, ops):
+        """Apply a batch of operations and log the ones that changed something, returning those.
+
+        The batch is validated against a copy first, so an invalid operation
+        leaves the document untouched.
+        """
+        with self.lock:
+            self.refresh()
+            state = copy.deepcopy(self.state)
+            changed = [op for op in ops if self.apply_op(state, op)]
+            if not changed:
+                return changed
+
+            if not self.wal_valid and self.logged:
+                # Fold the readable part of a damaged log into the file before starting a new one
+                self.compact()
+            self.state = state
+            lines = [json.dumps(op, ensure_ascii=False) + '\n' for op in changed]
+            if not self.wal_valid:
+                lines.insert(0, json.dumps({'base': self.base}) + '\n')
+            with open(self.wal_path, 'a' if self.wal_valid else 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            self.wal_valid = True
+            self.logged += len(changed)
+            self.version = self.current_version()
+
+            if self.logged >= COMPACT_AFTER_OPS:
+                self.compact()
+            return changed
+
+    def replace(self, document):
+        """Replace the whole document and write it out"""
+        with self.lock:
+            self.state = document
+            self.write()
+
+    def compact(self):
+        """Fold the log into the JSON file, if anything was logged since the file was written"""
+        with self.lock:
+            if self.state is None:
+                self.load()
+            if not self.logged and not os.path.exists(self.wal_path) and os.path.exists(self.path):
+                return
+            self.write()
+
+    def write(self):
+        """Write the current state to the JSON file (fsync, atomic rename) and drop the log"""
+        with self.lock:
+            data = json.dumps(self.state, indent=2, ensure_ascii=False).encode('utf-8')
+            write_atomic(self.path, [data], binary=True, durable=True)
+            if os.path.exists(self.wal_path):
+                os.remove(self.wal_path)
+                fsync_directory(self.wal_path)
+            self.base = hashlib.sha256(data).hexdigest()
+            self.logged = 0
+            self.wal_valid = False
+            self.version = self.current_version()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Responsive image variants for the campaign chronicle.
+Downscales and recompresses deployed images (including WebP versions), caches
+the results by source hash, and rewrites <img> tags with srcset/sizes and
+lazy loading. Requires Pillow; without it images are deployed as-is.
+"""
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+from image_store import BLOB_RE, CHUNK_SIZE
+
+# Widths (in CSS pixels) of the generated variants; larger images are capped at the last one
+VARIANT_WIDTHS = [480, 960, 1600]
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+# Content column is 1000px wide minus the section padding
+IMG_SIZES = '(max-width: 1000px) 100vw, 936px'
+# Bump whenever the variants change, so cached manifests are rebuilt
+VARIANTS_VERSION = 2
+
+# Metadata that can identify a player (GPS positions, camera serials, names in comments)
+METADATA_INFO_KEYS = {'exif', 'xmp', 'XML:com.adobe.xmp', 'comment', 'photoshop'}
+METADATA_JPEG_MARKERS = {'APP1', 'APP13', 'COM'}
+
+# HTML comments, running to the end if unclosed
+HTML_COMMENT_RE = re.compile(r'<!--.*?(?:-->|\Z)', re.DOTALL)
+# <img> tags; comments are matched only to be skipped
+IMG_TAG_RE = re.compile(HTML_COMMENT_RE.pattern + r'|<img\b[^>]*>', re.IGNORECASE | re.DOTALL)
+IMG_SRC_RE = re.compile(r'\ssrc="images/([^"/]+)"')
+
+def source_hash(path):
+    """Return the content hash of a source image, reusing the hash in a blob's name"""
+    name = os.path.basename(path)
+    if BLOB_RE.match(name):
+        return os.path.splitext(name)[0]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+def has_metadata(img):
+    """Whether an image file carries EXIF, XMP, IPTC, comments or PNG text chunks"""
+    # PNG text chunks after the image data are only read with it
+    img.load()
+    return (bool(METADATA_INFO_KEYS & set(img.info)) or bool(getattr(img, 'text', None))
+            or any(marker in METADATA_JPEG_MARKERS for marker, _ in getattr(img, 'applist', [])))
+
+def write_variants(img, source_path, img_hash, cache_dir):
+    """Encode the resized WebP and fallback variants of an open image, returning its manifest"""
+    # Animated images lose their animation when resized, so leave them alone
+    if getattr(img, 'is_animated', False):
+        return {'skip': True}
+
+    # The original is only ever deployed if it has nothing to strip (and so no rotation to apply)
+    keep_original = not has_metadata(img)
+
+    # Apply camera rotation; re-encoding also drops EXIF data such as GPS positions
+    img = ImageOps.exif_transpose(img)
+    has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+    img = img.convert('RGBA' if has_alpha else 'RGB')
+    fallback_ext = '.png' if has_alpha else '.jpg'
+
+    width, height = img.size
+    widths = sorted({w for w in VARIANT_WIDTHS if w < width} | {min(width, VARIANT_WIDTHS[-1])})
+    manifest = {'webp': [], 'fallback': []}
+    for w in widths:
+        resized = img if w == width else img.resize((w, round(height * w / width)), Image.LANCZOS)
+
+        webp_name = f'{img_hash}-{w}w.webp'
+        resized.save(os.path.join(cache_dir, webp_name), 'WEBP', quality=WEBP_QUALITY, method=6)
+        manifest['webp'].append([w, webp_name])
+
+        fallback_name = f'{img_hash}-{w}w{fallback_ext}'
+        fallback_path = os.path.join(cache_dir, fallback_name)
+        if fallback_ext == '.png':
+            resized.save(fallback_path, 'PNG', optimize=True)
+        else:
+            resized.save(fallback_path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+
+        # Keep a metadata-free original when recompressing it at full size doesn't make it smaller
+        if (keep_original and w == width and source_path.lower().endswith(fallback_ext)
+                and os.path.getsize(fallback_path) >= os.path.getsize(source_path)):
+            os.remove(fallback_path)
+            fallback_name = os.path.basename(source_path)
+        manifest['fallback'].append([w, fallback_name])
+
+    return manifest
+
+def manifest_path(cache_dir, img_hash):
+    return os.path.join(cache_dir, f'{img_hash}.v{VARIANTS_VERSION}.json')
+
+def build_variants(job):
+    """Worker entry point: write the variants of one (source path, hash, cache dir) image and return its manifest"""
+    source_path, img_hash, cache_dir = job
+    try:
+        img = Image.open(source_path)
+    except Image.UnidentifiedImageError:
+        # Not an image Pillow can read; cache that so it isn't retried every build
+        manifest = {'skip': True}
+    else:
+        with img:
+            manifest = write_variants(img, source_path, img_hash, cache_dir)
+
+    with open(manifest_path(cache_dir, img_hash), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    return manifest
+
+def optimize_images(names, source_dir, cache_dir, workers=None):
+    """Build (or reuse cached) variants for the named images, returning {name: manifest}"""
+    if Image is None:
+        print("Warning: Pillow not installed - images are deployed at full size (pip install pillow)")
+        return {}
+
+    os.makedirs(cache_dir, exist_ok=True)
+    manifests = {}
+    jobs = {}
+    cached = 0
+    for name in sorted(names):
+        source_path = os.path.join(source_dir, name)
+        if not os.path.exists(source_path):
+            continue
+        img_hash = source_hash(source_path)
+        cached_manifest = manifest_path(cache_dir, img_hash)
+        if os.path.exists(cached_manifest):
+            with open(cached_manifest, 'r', encoding='utf-8') as f:
+                manifests[name] = json.load(f)
+            cached += 1
+        else:
+            jobs[name] = (source_path, img_hash, cache_dir)
+
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {name: executor.submit(build_variants, job) for name, job in jobs.items()}
+            for name, future in futures.items():
+                try:
+                    manifests[name] = future.result()
+                except Exception as e:
+                    print(f"  Could not optimize {name}: {e}")
+
+    print(f"Optimized images: {len(jobs)} processed, {cached} from cache")
+    return {name: manifest for name, manifest in manifests.items() if not manifest.get('skip')}
+
+def rewrite_img_tags(html, manifests):
+    """Point <img> tags at optimized variants and make every image lazy-load"""
+    def srcset(entries):
+        return ', '.join(f'images/{name} {w}w' for w, name in entries)
+
+    def rewrite(match):
+        tag = match.group(0)
+        if tag.startswith('<!--'):
+            return tag
+        if 'loading=' not in tag:
+            tag = re.sub(r'\s*/?>$', ' loading="lazy" decoding="async"/>', tag)
+
+        src = IMG_SRC_RE.search(tag)
+        manifest = manifests.get(src.group(1)) if src else None
+        if manifest is None or 'srcset=' in tag:
+            return tag
+
+        fallback = manifest['fallback'][-1][1]
+        tag = tag.replace(src.group(0), f' src="images/{fallback}" srcset="{srcset(manifest["fallback"])}" sizes="{IMG_SIZES}"', 1)
+        return (f'<picture><source type="image/webp" srcset="{srcset(manifest["webp"])}" sizes="{IMG_SIZES}"/>'
+                f'{tag}</picture>')
+
+    return IMG_TAG_RE.sub(rewrite, html)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Keeps content_order.json and message_exclusions.json pointing at the right
+thread files when clean_emails.py moves messages between files.
+Both documents name thread files: the order lists each file and whether it is
+published, and an exclusion hides one message (found by its date) in one file.
+When a message lands in a different file (after switching --threading, or when
+a late message renames its thread), its exclusion stops applying, the order
+keeps pointing at a file nobody writes any more, and a message that was never
+published can be folded into a file that is.
+
+clean_emails.py records which file each message was written to
+(placements.json). Before writing, plan_migration() compares the new
+placements with the recorded ones and reports every move that touches an
+ordered or excluded file. Migrating rewrites both documents so order entries
+follow their messages to their new files, exclusions follow their messages,
+and messages that were not published before are excluded in the published
+file they moved into.
+"""
+import json
+import os
+
+from atomic_write import write_atomic
+
+class MigrationNeeded(Exception):
+    """Messages would move in a way content_order.json or message_exclusions.json doesn't follow"""
+
+    def __init__(self, problems):
+        super().__init__('\n'.join(problems))
+        self.problems = problems
+
+def load_placements(path):
+    """Return {message key: thread file} from an earlier run, or None if none was recorded"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_placements(path, placements):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, [json.dumps(placements, separators=(',', ':'))])
+
+def file_title(filename):
+    """The title organize_server.py gives a thread file (see thread_index.py)"""
+    return filename.replace('.html', '').replace('_', ' ')
+
+def plan_migration(previous, placements, dates, items, exclusions):
+    """Work out what moving messages between thread files does to the order and the exclusions.
+
+    previous and placements map message keys to the file each message was in
+    and will be in, dates maps keys to the date on the message's card. items
+    is content_order.json's item list and exclusions message_exclusions.json's
+    list. Returns (problems, items, exclusions): a line for each ordered or
+    excluded file the moves break, and the migrated item and exclusion lists.
+    No problems means nothing needs migrating.
+    """
+    moved = [(key, previous[key], new) for key, new in placements.items()
+             if previous.get(key) and previous[key] != new]
+    if not moved:
+        return [], items, exclusions
+
+    ordered = {}
+    for item in items:
+        if item.get('type') == 'email':
+            ordered.setdefault(item['filename'], item)
+    excluded = {(e['filename'], e['date']) for e in exclusions}
+    excluded_files = {filename for filename, _ in excluded}
+
+    # The files each earlier file's messages are in now, in message order
+    targets = {}
+    for key, new in placements.items():
+        old = previous.get(key)
+        if old:
+            targets.setdefault(old, {})[new] = None
+
+    def published_before(key):
+        item = ordered.get(previous[key])
+        return item is not None and not item.get('excluded', False) and (previous[key], dates[key]) not in excluded
+
+    # Each ordered file is replaced by the files its messages went to, in its place. A file that
+    # has an entry of its own keeps it; otherwise it takes the first entry whose messages reach it,
+    # published if any of those entries is.
+    keeps_entry = {filename for filename in ordered if filename in targets.get(filename, {filename: None})}
+    new_items = []
+    emitted = {}
+    for item in items:
+        filename = item.get('filename')
+        if item.get('type') != 'email' or filename not in targets:
+            if item.get('type') != 'email' or filename not in emitted:
+                new_items.append(item)
+                emitted[filename] = len(new_items) - 1
+            continue
+        for target in targets[filename]:
+            if target != filename and target in keeps_entry:
+                continue
+            if target in emitted:
+                position = emitted[target]
+                if target not in keeps_entry and new_items[position].get('excluded', False) and not item.get('excluded', False):
+                    new_items[position] = dict(new_items[position], excluded=False)
+                continue
+            new_items.append(item if target == filename else dict(item, filename=target, title=file_title(target)))
+            emitted[target] = len(new_items) - 1
+    published_after = {item['filename'] for item in new_items
+                       if item.get('type') == 'email' and not item.get('excluded', False)}
+
+    # Exclusions follow their messages; messages nobody published stay hidden in a published file
+    moved_from = {}
+    for key, old, new in moved:
+        moved_from.setdefault((old, dates[key]), []).append(new)
+    stayed = {(new, dates[key]) for key, new in placements.items() if previous.get(key) == new}
+    new_exclusions = {}
+    for exclusion in exclusions:
+        filename, date = exclusion['filename'], exclusion['date']
+        if (filename, date) not in moved_from or (filename, date) in stayed:
+            new_exclusions[(filename, date)] = None
+        for new in moved_from.get((filename, date), ()):
+            new_exclusions[(new, date)] = None
+    hidden = {}
+    withdrawn = {}
+    for key, old, new in moved:
+        if new in published_after:
+            if not published_before(key) and (new, dates[key]) not in new_exclusions:
+                new_exclusions[(new, dates[key])] = None
+                hidden[new] = hidden.get(new, 0) + 1
+        elif published_before(key):
+            withdrawn[new] = withdrawn.get(new, 0) + 1
+
+    problems = []
+    written = set(placements.values())
+    for old in sorted({old for _, old, _ in moved}):
+        if old not in ordered and old not in excluded_files:
+            continue
+        gone = [new for new in targets[old] if new != old]
+        what = 'is no longer written' if old not in written else 'loses messages'
+        refs = ' and '.join(name for name, hit in (('ordered', old in ordered), ('has exclusions', old in excluded_files)) if hit)
+        problems.append(f"{old} ({refs}) {what}: its messages move to {', '.join(gone)}")
+    for new, count in sorted(hidden.items()):
+        problems.append(f"{new} is published and would gain {count} message(s) that were never published")
+    for new, count in sorted(withdrawn.items()):
+        problems.append(f"{new} is not published, so {count} published message(s) moving into it would be hidden")
+    if not problems:
+        return [], items, exclusions
+    return problems, new_items, [{'filename': filename, 'date': date} for filename, date in new_exclusions]
@@ -5,15 +5,126 @@ Provides API endpoints for loading content, saving order, and serving previews.
 """
 import os
 import json
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+import argparse
+import sqlite3
+import threading
+import time
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import mimetypes
 
+from doc_cache import DocumentCache, DEFAULT_MAX_BYTES, parse_html
+from thread_index import ThreadIndex
+from exclusions import ExclusionIndex
+from content_order import order_journal
+from thread_search import MAX_HITS, ThreadSearch
+from preview import PREVIEW_SCRIPT, PREVIEW_SCRIPT_ETAG, PREVIEW_SCRIPT_PATH, note_pages, render_thread, thread_template
+from precompress import ENCODINGS, MIN_COMPRESS_SIZE, accepted_encodings, available_encodings, is_compressible
+
 OUTPUT_DIR = 'cleaned_emails'
 ORDER_FILE = 'content_order.json'
 MESSAGE_EXCLUSIONS_FILE = 'message_exclusions.json'
 
+# Parsed documents and the metadata extracted from them, shared by all requests
+DOC_CACHE = DocumentCache()
+
+# Thread file metadata written by clean_emails.py
+THREAD_INDEX = ThreadIndex(OUTPUT_DIR)
+
+# Excluded messages by file, shared by all requests and reloaded when the file changes
+EXCLUSIONS = ExclusionIndex(MESSAGE_EXCLUSIONS_FILE)
+
+# Full-text index of every card and note for /api/search, opened by the first search (see thread_search())
+THREAD_SEARCH_FILE = os.path.join(OUTPUT_DIR, '.cache', 'thread_search.sqlite')
+THREAD_SEARCH = None
+THREAD_SEARCH_LOCK = threading.Lock()
+
+# The saved order; edits are logged to content_order.json.wal and compacted periodically and on shutdown
+ORDER = order_journal(ORDER_FILE)
+
+def thread_search():
+    """Return the search index, opening it on first use.
+
+    Opening it can fail (SQLite built without FTS5, or a read-only .cache), and
+    only search needs it, so the organizer starts regardless. A failure raises
+    here and is retried on the next search.
+    """
+    global THREAD_SEARCH
+    with THREAD_SEARCH_LOCK:
+        if THREAD_SEARCH is None:
+            THREAD_SEARCH = ThreadSearch(THREAD_SEARCH_FILE, OUTPUT_DIR, 'player_notes.html')
+        return THREAD_SEARCH
+
+def read_player_notes(filepath):
+    """Extract the note cards of player_notes.html as organizer items"""
+    soup = DOC_CACHE.get(filepath, 'soup', parse_html)
+    notes = []
+
+    # Find all note cards
+    note_divs = soup.find_all('div', class_='note')
+
+    for idx, note_div in enumerate(note_divs):
+        # Extract title from h5
+        header = note_div.find('div', class_='card-header')
+        title_elem = header.find('h5') if header else None
+        title = title_elem.get_text(strip=True) if title_elem else f'Note {idx + 1}'
+
+        # Get the note ID
+        content_div = note_div.find('div', class_='note-content')
+        note_id = content_div.get('id') if content_div else f'note-{idx}'
+
+        notes.append({
+            'filename': f'player_notes.html#{note_id}',
+            'title': f'📝 {title}',
+            'type': 'note',
+            'size': len(str(note_div)),
+            'date': None,
+            'note_id': note_id
+        })
+
+    return notes
+
+def read_messages(filepath):
+    """Extract the date and a short body preview of each message card in an HTML file"""
+    soup = DOC_CACHE.get(filepath, 'soup', parse_html)
+    messages = []
+
+    # Find all message cards
+    cards = soup.find_all('div', class_='card')
+    for idx, card in enumerate(cards):
+        # Extract date from card header
+        header = card.find('div', class_='card-header')
+        date_elem = header.find('small') if header else None
+        date = date_elem.get_text(strip=True) if date_elem else None
+
+        # Extract body preview (first 200 chars)
+        body = card.find('div', class_='card-body')
+        body_text = body.get_text(strip=True)[:200] + '...' if body and len(body.get_text(strip=True)) > 200 else body.get_text(strip=True) if body else ''
+
+        messages.append({
+            'index': idx,
+            'date': date,
+            'preview': body_text
+        })
+
+    return messages
+
+def read_preview_template(filepath):
+    """Split a thread file into the strings and card slots its previews are assembled from"""
+    return thread_template(DOC_CACHE.get(filepath, 'soup', parse_html))
+
+def read_note_pages(filepath):
+    """Render the standalone preview page of every note in player_notes.html"""
+    return note_pages(DOC_CACHE.get(filepath, 'soup', parse_html))
+
+def read_bytes(filepath):
+    with open(filepath, 'rb') as f:
+        return f.read()
+
 class OrganizerHandler(SimpleHTTPRequestHandler):
+    # Keep connections open between requests; every response sends Content-Length
+    protocol_version = 'HTTP/1.1'
+
     def do_GET(self):
         parsed_path = urlparse(self.path)
         path = parsed_path.path
@@ -32,6 +143,10 @@ class OrganizerHandler(SimpleHTTPRequestHandler):
             filename = query.get('file', [''])[0]
             self.send_preview_with_controls(filename)
 
+        # API: Script of the preview controls, cached by the browser
+        elif path == PREVIEW_SCRIPT_PATH:
+            self.send_preview_script()
+
         # API: Preview content (regular)
         elif path.startswith('/api/preview'):
             query = parse_qs(parsed_path.query)
@@ -48,9 +163,18 @@ class OrganizerHandler(SimpleHTTPRequestHandler):
             filename = query.get('file', [''])[0]
             self.send_json(self.get_messages_from_file(filename))
 
+        # API: Full-text search over all cards and notes
+        elif path == '/api/search':
+            query = parse_qs(parsed_path.query)
+            self.send_json(self.search(query.get('q', [''])[0], query.get('limit', [''])[0]))
+
+        # API: Document cache hit/miss counters
+        elif path == '/api/cache-stats':
+            self.send_json(DOC_CACHE.stats())
+
         # Serve static files
         else:
-            super().do_GET()
+            self.send_static()
 
     def do_POST(self):
         parsed_path = urlparse(self.path)
@@ -61,8 +185,7 @@ class OrganizerHandler(SimpleHTTPRequestHandler):
             post_data = self.rfile.read(content_length)
             order_data = json.loads(post_data.decode('utf-8'))
 
-            with open(ORDER_FILE, 'w', encoding='utf-8') as f:
-                json.dump(order_data, f, indent=2)
+            ORDER.replace({'items': order_data.get('items', [])})
 
             self.send_json({'success': True, 'message': 'Order saved successfully'})
 
@@ -72,30 +195,56 @@ class OrganizerHandler(SimpleHTTPRequestHandler):
             post_data = self.rfile.read(content_length)
             exclusions_data = json.loads(post_data.decode('utf-8'))
 
-            with open(MESSAGE_EXCLUSIONS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(exclusions_data, f, indent=2)
+            EXCLUSIONS.replace(exclusions_data.get('exclusions', []))
 
             self.send_json({'success': True, 'message': 'Message exclusions saved'})
 
         else:
             self.send_error(404)
 
+    def do_PATCH(self):
+        parsed_path = urlparse(self.path)
+
+        # API: Apply a batch of {"op": ...} edits to the order or the message exclusions
+        if parsed_path.path in ('/api/order', '/api/message-exclusions'):
+            content_length = int(self.headers['Content-Length'])
+            post_data = self.rfile.read(content_length)
+            try:
+                body = json.loads(post_data.decode('utf-8'))
+            except ValueError as e:
+                self.send_json({'success': False, 'error': f'Invalid JSON: {e}'}, status=400)
+                return
+            ops = body.get('ops') if isinstance(body, dict) else None
+            if not isinstance(ops, list):
+                self.send_json({'success': False, 'error': 'Expected a JSON object with an "ops" list'}, status=400)
+                return
+
+            target = ORDER if parsed_path.path == '/api/order' else EXCLUSIONS
+            try:
+                applied = target.apply(ops)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                # Nothing was applied; the client falls back to saving everything
+                self.send_json({'success': False, 'error': str(e)}, status=409)
+                return
+
+            self.send_json({'success': True, 'applied': len(applied)})
+
+        else:
+            self.send_error(404)
+
     def get_items(self):
-        """Get list of all HTML files in cleaned_emails directory"""
+        """Get list of all HTML files in cleaned_emails directory, from the thread index"""
         items = []
 
         if os.path.exists(OUTPUT_DIR):
-            for filename in os.listdir(OUTPUT_DIR):
-                if filename.endswith('.html') and filename != 'index.html':
-                    filepath = os.path.join(OUTPUT_DIR, filename)
-                    date = self.extract_date_from_file(filepath)
-                    items.append({
-                        'filename': filename,
-                        'title': filename.replace('.html', '').replace('_', ' '),
-                        'type': 'email',
-                        'size': os.path.getsize(filepath),
-                        'date': date
-                    })
+            for thread in THREAD_INDEX.entries():
+                items.append({
+                    'filename': thread['filename'],
+                    'title': thread['title'],
+                    'type': 'email',
+                    'size': thread['size'],
+                    'date': thread['date']
+                })
 
         # Add individual player notes if file exists
         if os.path.exists('player_notes.html'):
@@ -106,62 +255,29 @@ class OrganizerHandler(SimpleHTTPRequestHandler):
 
     def parse_player_notes(self):
         """Parse player_notes.html into individual note items"""
-        from bs4 import BeautifulSoup
-
         try:
-            with open('player_notes.html', 'r', encoding='utf-8') as f:
-                content = f.read()
-
-            soup = BeautifulSoup(content, 'html.parser')
-            notes = []
-
-            # Find all note cards
-            note_divs = soup.find_all('div', class_='note')
-
-            for idx, note_div in enumerate(note_divs):
-                # Extract title from h5
-                header = note_div.find('div', class_='card-header')
-                title_elem = header.find('h5') if header else None
-                title = title_elem.get_text(strip=True) if title_elem else f'Note {idx + 1}'
-
-                # Get the note ID
-                content_div = note_div.find('div', class_='note-content')
-                note_id = content_div.get('id') if content_div else f'note-{idx}'
-
-                notes.append({
-                    'filename': f'player_notes.html#{note_id}',
-                    'title': f'📝 {title}',
-                    'type': 'note',
-                    'size': len(str(note_div)),
-                    'date': None,
-                    'note_id': note_id
-                })
-
-            return notes
+            return DOC_CACHE.get('player_notes.html', 'notes', read_player_notes)
         except Exception as e:
             print(f"Error parsing player notes: {e}")
             return []
 
-    def extract_date_from_file(self, filepath):
-        """Extract the earliest date from an HTML file"""
+    def search(self, q, limit):
+        """Search every card and note, returning ranked hits with snippets"""
+        started = time.perf_counter()
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-                # Look for dates in card headers (format: <small>date</small>)
-                import re
-                dates = re.findall(r'<small>([^<]+)</small>', content)
-                if dates:
-                    return dates[0]  # Return the first (oldest) date
-        except:
-            pass
-        return None
+            search = thread_search()
+        except (sqlite3.Error, OSError) as e:
+            return {'query': q, 'hits': [], 'error': f'Search is unavailable: {e}'}
+        try:
+            limit = max(1, min(int(limit), MAX_HITS)) if limit else MAX_HITS
+            hits = search.search(q, limit)
+        except Exception as e:
+            return {'query': q, 'hits': [], 'error': str(e)}
+        return {'query': q, 'hits': hits, 'took_ms': round((time.perf_counter() - started) * 1000, 2)}
 
     def get_saved_order(self):
-        """Load saved order from JSON file"""
-        if os.path.exists(ORDER_FILE):
-            with open(ORDER_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {'items': []}
+        """Return the saved order, including edits not yet compacted into the file"""
+        return ORDER.read()
 
     def send_preview(self, filename):
         """Send HTML content for preview"""
@@ -177,17 +293,12 @@ class OrganizerHandler(SimpleHTTPRequestHandler):
         if os.path.exists(filepath):
             with open(filepath, 'r', encoding='utf-8') as f:
                 content = f.read()
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(content.encode('utf-8'))
+            self.send_html(content)
         else:
             self.send_error(404, f'File not found: {filename}')
 
     def send_preview_with_controls(self, filename):
-        """Send HTML content with message exclusion controls injected"""
-        from bs4 import BeautifulSoup
-
+        """Send HTML content with message exclusion controls, assembled from the file's cached template"""
         # Check if this is a player note reference
         note_id = None
         actual_filename = filename
@@ -207,159 +318,41 @@ class OrganizerHandler(SimpleHTTPRequestHandler):
             return
 
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-
-            soup = BeautifulSoup(content, 'html.parser')
-
-            # If this is a player note, extract just that note
+            # If this is a player note, send just that note
             if note_id and actual_filename == 'player_notes.html':
-                note_div = soup.find('div', id=note_id)
-                if note_div:
-                    # Get the parent note card
-                    note_card = note_div.find_parent('div', class_='note')
-                    if note_card:
-                        # Create a new minimal HTML with just this note
-                        new_soup = BeautifulSoup(f'''<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Player Note</title>
-    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
-    <style>
-        body {{ margin: 20px; background: #f5f5f5; }}
-        .note {{ margin-bottom: 20px; }}
-    </style>
-</head>
-<body class="container">
-    {str(note_card)}
-</body>
-</html>''', 'html.parser')
-                        # Expand the note content to be visible
-                        content_div = new_soup.find('div', id=note_id)
-                        if content_div:
-                            content_div['style'] = 'display: block;'
-                        modified_content = str(new_soup)
-                        self.send_response(200)
-                        self.send_header('Content-type', 'text/html; charset=utf-8')
-                        self.end_headers()
-                        self.wfile.write(modified_content.encode('utf-8'))
-                        return
-
-            # Load current exclusions
-            exclusions = self.get_message_exclusions().get('exclusions', [])
-            excluded_dates = [e['date'] for e in exclusions if e['filename'] == filename]
-
-            # Find all message cards and inject exclude buttons
-            cards = soup.find_all('div', class_='card')
-            for idx, card in enumerate(cards):
-                header = card.find('div', class_='card-header')
-                if header:
-                    date_elem = header.find('small')
-                    if date_elem:
-                        message_date = date_elem.get_text(strip=True)
-                        is_excluded = message_date in excluded_dates
-
-                        # Create exclude button
-                        button_html = f'''
-                        <button class="message-exclude-btn {'excluded' if is_excluded else ''}"
-                                data-filename="{filename}"
-                                data-date="{message_date}"
-                                onclick="toggleMessageExclusion(this)"
-                                style="float: right; margin-left: 10px; padding: 0.2rem 0.5rem; font-size: 0.75rem; border-radius: 3px; cursor: pointer; transition: all 0.2s; {'background: #dc3545; color: white; border: 1px solid #dc3545;' if is_excluded else 'background: transparent; color: #666; border: 1px solid #ccc;'}">
-                            {'✓ Excluded' if is_excluded else '🚫 Exclude'}
-                        </button>
-                        '''
-                        button_tag = BeautifulSoup(button_html, 'html.parser')
-                        header.append(button_tag)
-
-                        # Add excluded styling if needed
-                        if is_excluded:
-                            card['style'] = 'opacity: 0.5; border-color: #dc3545; background: #f8d7da;'
-
-            # Inject JavaScript for handling exclusions
-            script = soup.new_tag('script')
-            script.string = '''
-                function toggleMessageExclusion(button) {
-                    const filename = button.dataset.filename;
-                    const date = button.dataset.date;
-                    const isExcluded = button.classList.contains('excluded');
-
-                    // Send message to parent window
-                    window.parent.postMessage({
-                        type: 'toggleMessageExclusion',
-                        filename: filename,
-                        date: date,
-                        excluded: !isExcluded
-                    }, '*');
-
-                    // Update button appearance
-                    const card = button.closest('.card');
-                    if (!isExcluded) {
-                        button.classList.add('excluded');
-                        button.textContent = '✓ Excluded';
-                        button.style.background = '#dc3545';
-                        button.style.color = 'white';
-                        button.style.borderColor = '#dc3545';
-                        if (card) {
-                            card.style.opacity = '0.5';
-                            card.style.borderColor = '#dc3545';
-                            card.style.background = '#f8d7da';
-                        }
-                    } else {
-                        button.classList.remove('excluded');
-                        button.textContent = '🚫 Exclude';
-                        button.style.background = 'transparent';
-                        button.style.color = '#666';
-                        button.style.borderColor = '#ccc';
-                        if (card) {
-                            card.style.opacity = '1';
-                            card.style.borderColor = '';
-                            card.style.background = '';
-                        }
-                    }
-                }
-
-                // Add hover effects
-                document.addEventListener('DOMContentLoaded', function() {
-                    const buttons = document.querySelectorAll('.message-exclude-btn');
-                    buttons.forEach(btn => {
-                        btn.addEventListener('mouseenter', function() {
-                            if (!this.classList.contains('excluded')) {
-                                this.style.background = '#f0f0f0';
-                            }
-                        });
-                        btn.addEventListener('mouseleave', function() {
-                            if (!this.classList.contains('excluded')) {
-                                this.style.background = 'transparent';
-                            }
-                        });
-                    });
-                });
-            '''
-            soup.body.append(script)
-
-            modified_content = str(soup)
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(modified_content.encode('utf-8'))
+                page = DOC_CACHE.get(filepath, 'note_pages', read_note_pages).get(note_id)
+                if page is not None:
+                    self.send_html(page)
+                    return
+
+            parts = DOC_CACHE.get(filepath, 'preview', read_preview_template)
+            self.send_html(render_thread(parts, filename, EXCLUSIONS.dates(filename)))
 
         except Exception as e:
             self.send_error(500, f'Error processing file: {str(e)}')
 
+    def send_preview_script(self):
+        """Send the preview controls' script, or 304 if the browser's copy is current"""
+        if PREVIEW_SCRIPT_ETAG in self.headers.get('If-None-Match', ''):
+            self.send_response(304)
+            self.send_header('ETag', PREVIEW_SCRIPT_ETAG)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-type', 'text/javascript; charset=utf-8')
+        self.send_header('Content-Length', str(len(PREVIEW_SCRIPT)))
+        self.send_header('ETag', PREVIEW_SCRIPT_ETAG)
+        # Previews request it by a versioned URL, so it never goes stale
+        self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+        self.end_headers()
+        self.wfile.write(PREVIEW_SCRIPT)
+
     def get_message_exclusions(self):
-        """Load message exclusions from JSON file"""
-        if os.path.exists(MESSAGE_EXCLUSIONS_FILE):
-            with open(MESSAGE_EXCLUSIONS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {'exclusions': []}
+        """Return message exclusions in the layout of message_exclusions.json"""
+        return {'exclusions': EXCLUSIONS.exclusions()}
 
     def get_messages_from_file(self, filename):
         """Parse individual messages from an HTML file"""
-        from bs4 import BeautifulSoup
-
         # Security: prevent path traversal
         filename = os.path.basename(filename)
 
@@ -372,49 +365,94 @@ class OrganizerHandler(SimpleHTTPRequestHandler):
             return {'messages': []}
 
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-
-            soup = BeautifulSoup(content, 'html.parser')
-            messages = []
-
-            # Find all message cards
-            cards = soup.find_all('div', class_='card')
-            for idx, card in enumerate(cards):
-                # Extract date from card header
-                header = card.find('div', class_='card-header')
-                date_elem = header.find('small') if header else None
-                date = date_elem.get_text(strip=True) if date_elem else None
-
-                # Extract body preview (first 200 chars)
-                body = card.find('div', class_='card-body')
-                body_text = body.get_text(strip=True)[:200] + '...' if body and len(body.get_text(strip=True)) > 200 else body.get_text(strip=True) if body else ''
-
-                messages.append({
-                    'index': idx,
-                    'date': date,
-                    'preview': body_text,
-                    'filename': filename
-                })
-
-            return {'messages': messages}
+            messages = DOC_CACHE.get(filepath, 'messages', read_messages)
+            return {'messages': [dict(message, filename=filename) for message in messages]}
         except Exception as e:
             return {'messages': [], 'error': str(e)}
 
-    def send_json(self, data):
-        """Send JSON response"""
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
+    def send_static(self):
+        """Serve a static file, compressed when the client accepts it.
+
+        Uses the .br/.gz sibling generate_final.py wrote if it is at least as
+        new as the file, and otherwise compresses on the fly, keeping the result
+        in the document cache until the file changes.
+        """
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) and self.path.endswith('/'):
+            path = os.path.join(path, 'index.html')
+        accepted = accepted_encodings(self.headers.get('Accept-Encoding'))
+        if not accepted or not is_compressible(path) or not os.path.isfile(path):
+            return super().do_GET()
+        stat = os.stat(path)
+        if stat.st_size < MIN_COMPRESS_SIZE:
+            return super().do_GET()
+
+        for name, suffix, compress in ENCODINGS:
+            if name not in accepted:
+                continue
+            sibling = path + suffix
+            if os.path.isfile(sibling) and os.stat(sibling).st_mtime_ns >= stat.st_mtime_ns:
+                with open(sibling, 'rb') as f:
+                    body = f.read()
+            elif (name, suffix, compress) in available_encodings():
+                body = DOC_CACHE.get(path, name, lambda p, compress=compress: compress(read_bytes(p)))
+            else:
+                continue
+
+            self.send_response(200)
+            self.send_header('Content-type', self.guess_type(path))
+            self.send_header('Content-Encoding', name)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Last-Modified', self.date_time_string(stat.st_mtime))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        super().do_GET()
+
+    def send_body(self, body, content_type, status=200):
+        """Send a response with a Content-Length, as keep-alive connections require"""
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+        self.wfile.write(body)
+
+    def send_html(self, content):
+        """Send HTML response"""
+        self.send_body(content.encode('utf-8'), 'text/html; charset=utf-8')
+
+    def send_json(self, data, status=200):
+        """Send JSON response"""
+        self.send_body(json.dumps(data).encode('utf-8'), 'application/json', status)
+
+class OrganizerServer(ThreadingHTTPServer):
+    """Handles each connection on its own thread so a slow preview doesn't block other requests"""
+    # The UI fires several requests at once on load; don't refuse connections in bursts
+    request_queue_size = 64
 
-def run_server(port=8000):
+def run_server(port=8000, cache_bytes=DEFAULT_MAX_BYTES):
+    DOC_CACHE.max_bytes = cache_bytes
     server_address = ('', port)
-    httpd = HTTPServer(server_address, OrganizerHandler)
+    httpd = OrganizerServer(server_address, OrganizerHandler)
     print(f'Content Organizer running at http://localhost:{port}/')
     print(f'Open organize_interface.html in your browser')
     print('Press Ctrl+C to stop')
-    httpd.serve_forever()
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        # Fold the logged edits into the JSON files so other tools see plain files
+        ORDER.compact()
+        EXCLUSIONS.compact()
 
 if __name__ == '__main__':
-    run_server()
+    parser = argparse.ArgumentParser(description='Local server for the content organizer')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on (default: 8000)')
+    parser.add_argument('--cache-mb', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help='Memory cap for parsed documents in MB (default: %(default)s)')
+    args = parser.parse_args()
+    run_server(args.port, args.cache_mb * 1024 * 1024)
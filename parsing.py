@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+HTML parsing shared by every script.
+Picks the fastest BeautifulSoup tree builder installed (lxml, then Python's
+built-in html.parser), and offers strainers so callers that only read the
+message cards or notes of a file skip building the rest of the tree.
+
+The thread files and player_notes.html are written by our own scripts, so
+those are parsed with the fastest builder. lxml and html.parser don't always
+build the same tree from them; what matters is what the scripts read, and
+running this module checks that every message card's date and text, and every
+note's title, id and text, match a full html.parser parse. Serialized markup
+can still differ, so generate_final.py's fragment cache keys each section by
+the builder that rendered it. Raw email bodies are fragments, often malformed:
+lxml would wrap them in <html><body> and repair them differently, changing
+every cleaned message, so clean_emails.py keeps html.parser for them
+(EMAIL_BACKEND).
+
+Run directly to benchmark each backend on the thread files and run that check.
+"""
+import argparse
+import os
+import statistics
+import time
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml
+except ImportError:
+    lxml = None
+
+# BeautifulSoup tree builders in order of preference
+BACKENDS = ['lxml', 'html.parser']
+EMAIL_BACKEND = 'html.parser'
+
+def class_strainer(name, class_name):
+    """A SoupStrainer for name tags with class_name among their classes.
+
+    While parsing, the strainer sees the class attribute as one unsplit
+    string, so class_=class_name alone would miss class="card shadow-sm".
+    """
+    def has_class(value):
+        return value is not None and class_name in value.split()
+    return SoupStrainer(name, class_=has_class)
+
+# Just the message cards of a thread file, or the note cards of player_notes.html
+CARDS = class_strainer('div', 'card')
+NOTES = class_strainer('div', 'note')
+
+def available_backends():
+    """Return the BACKENDS usable with the installed packages"""
+    return [backend for backend in BACKENDS if backend != 'lxml' or lxml is not None]
+
+DEFAULT_BACKEND = available_backends()[0]
+
+def parse(markup, parse_only=None, backend=None):
+    """Parse markup with the fastest backend (or the one given), optionally keeping only what parse_only matches"""
+    return BeautifulSoup(markup, backend or DEFAULT_BACKEND, parse_only=parse_only)
+
+def parse_file(path, parse_only=None):
+    """Read and parse an HTML file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return parse(f.read(), parse_only)
+
+def extracted_cards(soup):
+    """What the organizer reads from a thread: each card's header date and body text"""
+    cards = []
+    for card in soup.find_all('div', class_='card'):
+        header = card.find('div', class_='card-header')
+        date = header.find('small') if header else None
+        body = card.find('div', class_='card-body')
+        cards.append((date.get_text(strip=True) if date else None, body.get_text(' ', strip=True) if body else ''))
+    return cards
+
+def extracted_notes(soup):
+    """What the organizer reads from player_notes.html: each note's title, content id and text"""
+    notes = []
+    for note in soup.find_all('div', class_='note'):
+        title = note.find('h5')
+        content = note.find('div', class_='note-content')
+        notes.append((title.get_text(strip=True) if title else None,
+                      content.get('id') if content else None,
+                      content.get_text(' ', strip=True) if content else ''))
+    return notes
+
+def benchmark(paths, rounds):
+    """Time full and strained parses per backend and compare what they extract"""
+    documents = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        is_notes = os.path.basename(path) == 'player_notes.html'
+        documents.append((path, content, NOTES if is_notes else CARDS, extracted_notes if is_notes else extracted_cards))
+    total_mb = sum(len(content.encode('utf-8')) for _, content, _, _ in documents) / (1024 * 1024)
+    print(f"{len(documents)} file(s), {total_mb:.2f} MB, {rounds} round(s)")
+
+    # Everything is checked against a full html.parser parse
+    reference = None
+    for backend in reversed(available_backends()):
+        for strained in (False, True):
+            timings = []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                soups = [parse(content, strainer if strained else None, backend) for _, content, strainer, _ in documents]
+                timings.append(time.perf_counter() - started)
+            best = min(timings)
+            print(f"  {backend:<12} {'strained' if strained else 'full':<9} {total_mb / best:6.2f} MB/s  "
+                  f"({best * 1000:.0f} ms per pass, median {statistics.median(timings) * 1000:.0f} ms)")
+
+            extracted = [extract(soup) for soup, (_, _, _, extract) in zip(soups, documents)]
+            if reference is None:
+                reference = extracted
+                continue
+            mismatched = [path for (path, _, _, _), a, b in zip(documents, reference, extracted) if a != b]
+            if mismatched:
+                print(f"    extracted output differs from a full html.parser parse for {len(mismatched)} file(s), e.g. {mismatched[0]}")
+            else:
+                print("    extracted output identical")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the HTML parser backends on the thread files.')
+    parser.add_argument('--dir', default='cleaned_emails', help='directory of thread files (default: %(default)s)')
+    parser.add_argument('--notes', default='player_notes.html', help='player notes file (default: %(default)s)')
+    parser.add_argument('--rounds', type=int, default=5, help='passes per backend (default: %(default)s)')
+    args = parser.parse_args()
+
+    paths = sorted(os.path.join(args.dir, name) for name in os.listdir(args.dir)
+                   if name.endswith('.html') and name != 'index.html')
+    if os.path.exists(args.notes):
+        paths.append(args.notes)
+    if lxml is None:
+        print("lxml is not installed (pip install lxml); only html.parser is available")
+    benchmark(paths, args.rounds)
+
+if __name__ == '__main__':
+    main()
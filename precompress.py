@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Precompressed copies of the deployed text files.
+Writes .gz (and, with the brotli package installed, .br) siblings of every
+HTML/CSS/JS file in public/, which GitLab Pages serves to browsers that accept
+them. A manifest of content hashes means unchanged files are not recompressed.
+Also used by organize_server.py to pick or build compressed responses.
+"""
+import gzip
+import hashlib
+import json
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from atomic_write import write_atomic
+
+COMPRESSIBLE_EXTENSIONS = {'.html', '.css', '.js', '.json', '.svg', '.txt'}
+# Below this, compression saves less than the extra request/header overhead
+MIN_COMPRESS_SIZE = 1024
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+def gzip_bytes(data):
+    # mtime=0 keeps the output identical for identical input
+    return gzip.compress(data, GZIP_LEVEL, mtime=0)
+
+def brotli_bytes(data):
+    return brotli.compress(data, quality=BROTLI_QUALITY)
+
+# Content-Encoding token, file suffix and compressor, in order of preference
+ENCODINGS = [('br', '.br', brotli_bytes), ('gzip', '.gz', gzip_bytes)]
+
+def available_encodings():
+    """Return the ENCODINGS entries usable with the installed packages"""
+    return [encoding for encoding in ENCODINGS if encoding[0] != 'br' or brotli is not None]
+
+def is_compressible(path):
+    return os.path.splitext(path)[1].lower() in COMPRESSIBLE_EXTENSIONS
+
+def accepted_encodings(header):
+    """Return the content codings an Accept-Encoding header allows (q > 0)"""
+    accepted = set()
+    for part in (header or '').split(','):
+        token, _, params = part.partition(';')
+        token = token.strip().lower()
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if token and quality > 0:
+            accepted.add(token)
+    return accepted
+
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def remove_siblings(path, keep=()):
+    """Delete the compressed siblings of path other than those listed in keep"""
+    for _, suffix, _ in ENCODINGS:
+        sibling = path + suffix
+        if sibling not in keep and os.path.exists(sibling):
+            os.remove(sibling)
+
+def precompress_tree(root, manifest_path):
+    """Write compressed siblings for the text files under root, skipping files whose hash is unchanged.
+
+    Siblings of files that are gone, too small or no longer compressible with
+    the installed packages are removed, so a stale copy is never served.
+    Returns (files compressed, files unchanged).
+    """
+    manifest = load_manifest(manifest_path)
+    encodings = available_encodings()
+    suffixes = {suffix for _, suffix, _ in ENCODINGS}
+    updated = {}
+    compressed = unchanged = 0
+
+    for directory, _, filenames in os.walk(root):
+        present = set(filenames)
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            stem, suffix = os.path.splitext(path)
+            if suffix in suffixes:
+                # Drop siblings whose original went away
+                if os.path.basename(stem) not in present or not is_compressible(stem):
+                    os.remove(path)
+                continue
+            # Skip non-text files and temporary files of a write in progress
+            if not is_compressible(path) or filename.startswith('.'):
+                continue
+
+            with open(path, 'rb') as f:
+                data = f.read()
+            if len(data) < MIN_COMPRESS_SIZE:
+                remove_siblings(path)
+                continue
+
+            rel = os.path.relpath(path, root)
+            digest = hashlib.sha256(data).hexdigest()
+            entry = {'sha256': digest, 'encodings': [name for name, _, _ in encodings]}
+            updated[rel] = entry
+            siblings = [(path + suffix, compress) for _, suffix, compress in encodings]
+            if manifest.get(rel) == entry and all(os.path.exists(sibling) for sibling, _ in siblings):
+                # The file may have been rewritten with the same content; keep siblings at least as new
+                mtime = os.stat(path).st_mtime_ns
+                for sibling, _ in siblings:
+                    if os.stat(sibling).st_mtime_ns < mtime:
+                        os.utime(sibling, ns=(mtime, mtime))
+                unchanged += 1
+                continue
+
+            for sibling, compress in siblings:
+                write_atomic(sibling, [compress(data)], binary=True)
+            remove_siblings(path, keep={sibling for sibling, _ in siblings})
+            compressed += 1
+
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    write_atomic(manifest_path, [json.dumps(updated, indent=2, sort_keys=True)])
+    return compressed, unchanged
+
+def precompress_deployment(root, manifest_path):
+    """precompress_tree() with a one-line summary"""
+    compressed, unchanged = precompress_tree(root, manifest_path)
+    names = ' and '.join(suffix for _, suffix, _ in reversed(available_encodings()))
+    print(f"Precompressed ({names}): {compressed} file(s) written, {unchanged} unchanged")
+    if brotli is None:
+        print("   (pip install brotli to also write .br files)")
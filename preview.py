@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Preview pages with message exclusion controls for organize_server.py.
+Each thread file is serialized once into a template: the page's HTML split at
+every message card, with a slot for the card's style and one for its exclude
+button. A preview is then assembled by joining strings with the current
+exclusions filled in, instead of copying, editing and re-serializing the whole
+tree per request. The controls' script is a static asset (PREVIEW_SCRIPT_PATH)
+the browser caches and revalidates by ETag.
+"""
+import copy
+import hashlib
+import html
+import re
+
+# Slot markers that can't occur in the page text, split out after serializing
+SLOT_START = '\ue000'
+SLOT_END = '\ue001'
+SLOT_RE = re.compile(f' style="{SLOT_START}S(\\d+){SLOT_END}"|{SLOT_START}B(\\d+){SLOT_END}')
+
+EXCLUDED_CARD_STYLE = 'opacity: 0.5; border-color: #dc3545; background: #f8d7da;'
+BUTTON_STYLE = 'float: right; margin-left: 10px; padding: 0.2rem 0.5rem; font-size: 0.75rem; border-radius: 3px; cursor: pointer; transition: all 0.2s;'
+EXCLUDED_BUTTON_STYLE = 'background: #dc3545; color: white; border: 1px solid #dc3545;'
+INCLUDED_BUTTON_STYLE = 'background: transparent; color: #666; border: 1px solid #ccc;'
+
+PREVIEW_SCRIPT = '''function toggleMessageExclusion(button) {
+    const filename = button.dataset.filename;
+    const date = button.dataset.date;
+    const isExcluded = button.classList.contains('excluded');
+
+    // Send message to parent window
+    window.parent.postMessage({
+        type: 'toggleMessageExclusion',
+        filename: filename,
+        date: date,
+        excluded: !isExcluded
+    }, '*');
+
+    // Update button appearance
+    const card = button.closest('.card');
+    if (!isExcluded) {
+        button.classList.add('excluded');
+        button.textContent = '✓ Excluded';
+        button.style.background = '#dc3545';
+        button.style.color = 'white';
+        button.style.borderColor = '#dc3545';
+        if (card) {
+            card.style.opacity = '0.5';
+            card.style.borderColor = '#dc3545';
+            card.style.background = '#f8d7da';
+        }
+    } else {
+        button.classList.remove('excluded');
+        button.textContent = '🚫 Exclude';
+        button.style.background = 'transparent';
+        button.style.color = '#666';
+        button.style.borderColor = '#ccc';
+        if (card) {
+            card.style.opacity = '1';
+            card.style.borderColor = '';
+            card.style.background = '';
+        }
+    }
+}
+
+// Add hover effects
+document.addEventListener('DOMContentLoaded', function() {
+    const buttons = document.querySelectorAll('.message-exclude-btn');
+    buttons.forEach(btn => {
+        btn.addEventListener('mouseenter', function() {
+            if (!this.classList.contains('excluded')) {
+                this.style.background = '#f0f0f0';
+            }
+        });
+        btn.addEventListener('mouseleave', function() {
+            if (!this.classList.contains('excluded')) {
+                this.style.background = 'transparent';
+            }
+        });
+    });
+});
+'''.encode('utf-8')
+
+PREVIEW_SCRIPT_PATH = '/api/preview-controls.js'
+PREVIEW_SCRIPT_VERSION = hashlib.sha256(PREVIEW_SCRIPT).hexdigest()[:16]
+PREVIEW_SCRIPT_ETAG = f'"{PREVIEW_SCRIPT_VERSION}"'
+
+NOTE_PAGE = '''<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Player Note</title>
+    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
+    <style>
+        body {{ margin: 20px; background: #f5f5f5; }}
+        .note {{ margin-bottom: 20px; }}
+    </style>
+</head>
+<body class="container">
+    {note}
+</body>
+</html>'''
+
+def thread_template(soup):
+    """Serialize a thread once, returning its HTML as a list of strings and (kind, date, style) slots.
+
+    kind is 'style' for a card's style attribute (style is the card's own, if
+    any) and 'button' for the exclude button at the end of its header.
+    """
+    soup = copy.copy(soup)
+    slots = []
+    for card in soup.find_all('div', class_='card'):
+        header = card.find('div', class_='card-header')
+        date_elem = header.find('small') if header else None
+        if not date_elem:
+            continue
+        date = date_elem.get_text(strip=True)
+        slots.append(('style', date, card.get('style')))
+        card['style'] = f'{SLOT_START}S{len(slots) - 1}{SLOT_END}'
+        slots.append(('button', date, None))
+        header.append(f'{SLOT_START}B{len(slots) - 1}{SLOT_END}')
+
+    # The versioned URL lets the browser keep the script without asking again
+    script = soup.new_tag('script', src=f'{PREVIEW_SCRIPT_PATH}?v={PREVIEW_SCRIPT_VERSION}')
+    (soup.body or soup).append(script)
+
+    parts = []
+    pieces = SLOT_RE.split(str(soup))
+    # split() yields text, style slot group, button slot group, text, ...
+    for i in range(0, len(pieces), 3):
+        parts.append(pieces[i])
+        if i + 1 < len(pieces):
+            parts.append(slots[int(pieces[i + 1] or pieces[i + 2])])
+    return parts
+
+def exclude_button(filename, date, excluded):
+    state = 'excluded' if excluded else ''
+    style = BUTTON_STYLE + ' ' + (EXCLUDED_BUTTON_STYLE if excluded else INCLUDED_BUTTON_STYLE)
+    label = '✓ Excluded' if excluded else '🚫 Exclude'
+    return (f'<button class="message-exclude-btn {state}" data-filename="{html.escape(filename)}" '
+            f'data-date="{html.escape(date)}" onclick="toggleMessageExclusion(this)" style="{style}">{label}</button>')
+
+def render_thread(parts, filename, excluded_dates):
+    """Fill a thread template's slots for the given excluded message dates"""
+    out = []
+    for part in parts:
+        if isinstance(part, str):
+            out.append(part)
+            continue
+        kind, date, style = part
+        excluded = date in excluded_dates
+        if kind == 'button':
+            out.append(exclude_button(filename, date, excluded))
+        elif excluded:
+            out.append(f' style="{EXCLUDED_CARD_STYLE}"')
+        elif style is not None:
+            out.append(f' style="{html.escape(style)}"')
+    return ''.join(out)
+
+def note_pages(soup):
+    """Render a standalone page for every note in player_notes.html, keyed by the id of its content div"""
+    pages = {}
+    for content_div in soup.find_all('div', id=True):
+        note_card = content_div.find_parent('div', class_='note')
+        if note_card is None or content_div['id'] in pages:
+            continue
+        # Expand the note content, which the notes page collapses
+        note_card = copy.copy(note_card)
+        note_card.find('div', id=content_div['id'])['style'] = 'display: block;'
+        pages[content_div['id']] = NOTE_PAGE.format(note=str(note_card))
+    return pages
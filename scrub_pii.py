@@ -6,9 +6,24 @@ Run this after generate_final.py and before deploying to GitLab Pages.
 import re
 import os
 import json
+import bisect
+import argparse
+
+from atomic_write import HASHED_NAME_LENGTH, hashed_name, write_atomic
+from precompress import precompress_deployment
+from search_index import write_search_index
 
 PUBLIC_HTML = os.path.join('public', 'index.html')
+PUBLIC_SECTIONS_DIR = os.path.join('public', 'sections')
+PRECOMPRESS_MANIFEST = os.path.join('cleaned_emails', '.cache', 'precompress.json')
+SEARCH_CACHE = os.path.join('cleaned_emails', '.cache', 'search.json')
 PII_CONFIG_FILE = 'pii_config.json'
+MAX_REPORTED_SPANS = 20
+# Links from the split index page to its section files (see generate_final.py --split)
+SECTION_LINK_RE = re.compile(r'sections/([0-9a-f]{%d}\.html)' % HASHED_NAME_LENGTH)
+# How far around a replacement a later rule's match is looked for; patterns are
+# names, addresses and phone numbers, far shorter than this
+BOUNDARY_WINDOW = 256
 
 # PII patterns to scrub
 PII_PATTERNS = [
@@ -49,9 +64,366 @@ def load_name_replacements():
         print(f"ERROR: Failed to load {PII_CONFIG_FILE}: {e}")
         return {}
 
-def scrub_pii_from_html(html_content, name_replacements):
+# Patterns that refer back to their own groups can't be renumbered into one alternation
+BACKREFERENCE_RE = re.compile(r'\\[1-9]|\(\?P=')
+WORD_CHAR_RE = re.compile(r'\w')
+
+class NeedsSequential(Exception):
+    """A match only applying the rules one after another handles like re.sub: an empty match, or one
+    whose replacement can change what later rules see"""
+
+class PIIScrubber:
+    """
+    All PII patterns and name replacements compiled into one alternation.
+
+    Text is scrubbed in a single scan: each match is attributed to its rule by a
+    trailing empty marker group, counted and replaced. Rules keep their order of
+    precedence and replacement text is run through the later rules. Where an
+    earlier rule matches inside a later rule's match, a match is glued to word
+    characters (so replacing it could create a word boundary for a later rule),
+    or a later rule matches across the edge of a replacement (the replacement
+    together with the text around it, which only applying the rules in turn
+    sees), the string is scrubbed rule by rule instead: a later rule's match can reach
+    anywhere, even across lines, so no smaller stretch is safe to redo. The output
+    matches scrub_pii_sequential() (--self-test checks the cases that went wrong
+    before, --verify a whole run). Counts accumulate across scrub() calls.
+    """
+
+    def __init__(self, name_replacements, single_pass=True):
+        self.rules = []
+        for pii in PII_PATTERNS:
+            self.rules.append({
+                'pattern': re.compile(pii['pattern'], re.IGNORECASE),
+                'replacement': pii['replacement'],
+                'label': pii['description'],
+                'change': lambda count, pii=pii: f"Removed {count} {pii['description']}"
+            })
+        for name_pattern, replacement in name_replacements.items():
+            self.rules.append({
+                'pattern': re.compile(name_pattern),
+                'replacement': replacement,
+                'label': f"'{name_pattern}'",
+                'change': lambda count, name_pattern=name_pattern, replacement=replacement:
+                    f"Replaced {count} instance(s) of '{name_pattern}' with '{replacement}'"
+            })
+        self.counts = [0] * len(self.rules)
+
+        self.combined = None
+        if single_pass and not any(BACKREFERENCE_RE.search(rule['pattern'].pattern) for rule in self.rules):
+            try:
+                self.combined, self.markers = self.alternation(len(self.rules))
+            except re.error:
+                # e.g. a global inline flag like (?i) that is only allowed at the start
+                self.combined = None
+
+        # Alternations of the rules before each rule, for spotting overlaps
+        self.earlier = {}
+        # Literal replacements always cascade to the same text, so work that out once
+        self.cascades = {}
+
+    def alternation(self, count):
+        """Compile the first count rules into one regex, returning it and {marker group: rule index}.
+
+        Consecutive rules starting with \\b share it, so each branch starts with
+        the rule's first character and the regex engine can skip branches quickly.
+        """
+        branches = []
+        markers = {}
+        group = 0
+        for index in range(count):
+            pattern = self.rules[index]['pattern']
+            flags = 'i' if pattern.flags & re.IGNORECASE else ''
+            text = pattern.pattern
+            boundary = text.startswith('\\b') and len(text) > 2 and '|' not in text
+            if boundary:
+                text = text[2:]
+            group += pattern.groups + 1
+            markers[group] = index
+            branch = f'(?{flags}:{text})()'
+            if boundary and branches and branches[-1][0]:
+                branches[-1][1].append(branch)
+            else:
+                branches.append((boundary, [branch]))
+
+        regex = '|'.join(
+            f"\\b(?:{'|'.join(block)})" if boundary else block[0]
+            for boundary, block in branches
+        )
+        return re.compile(regex), markers
+
+    def cascade(self, index, text):
+        """Run replacement text of rule index through every later rule, returning (text, counts)"""
+        counts = {}
+        for later in range(index + 1, len(self.rules)):
+            rule = self.rules[later]
+            text, count = rule['pattern'].subn(rule['replacement'], text)
+            if count:
+                counts[later] = count
+        return text, counts
+
+    def replacement(self, index, match):
+        """Return the final text for a match of rule index, counting it and any cascaded matches"""
+        rule = self.rules[index]
+        self.counts[index] += 1
+
+        if '\\' in rule['replacement']:
+            # Expand group references against the rule's own numbering
+            own = rule['pattern'].match(match.string, match.start())
+            text, counts = self.cascade(index, own.expand(rule['replacement']))
+        else:
+            if index not in self.cascades:
+                self.cascades[index] = self.cascade(index, rule['replacement'])
+            text, counts = self.cascades[index]
+
+        for later, count in counts.items():
+            self.counts[later] += count
+        return text
+
+    def overlaps(self, index, text, start, end):
+        """Does an earlier rule match starting inside text[start:end]?"""
+        if index == 0:
+            return False
+        if index not in self.earlier:
+            self.earlier[index] = self.alternation(index)[0]
+        earlier = self.earlier[index]
+        return any(earlier.match(text, position) for position in range(start + 1, end))
+
+    def crosses_replacement(self, text, replaced):
+        """Does a later rule match across the edge of a replacement in the scrubbed text?
+
+        replaced lists (start, end, rule index) for each replacement, with
+        offsets into text. Matches inside a replacement were already cascaded.
+        """
+        for start, end, index in replaced:
+            low = max(0, start - BOUNDARY_WINDOW)
+            high = min(len(text), end + BOUNDARY_WINDOW)
+            for later in range(index + 1, len(self.rules)):
+                pattern = self.rules[later]['pattern']
+                position = low
+                while True:
+                    # Try every start, so a match elsewhere can't hide an overlapping one
+                    match = pattern.search(text, position, high)
+                    if match is None or match.start() >= max(end, start + 1):
+                        break
+                    if match.end() > start and not (start <= match.start() and match.end() <= end):
+                        return True
+                    position = match.start() + 1
+        return False
+
+    def scrub_in_turn(self, text, spans=None):
+        """Apply each rule to the whole text in turn, as scrub_pii_sequential() does"""
+        labels = []
+        length = len(text)
+        for index, rule in enumerate(self.rules):
+            text, count = rule['pattern'].subn(rule['replacement'], text)
+            self.counts[index] += count
+            if count:
+                labels.append(rule['label'])
+        if spans is not None and labels:
+            spans.append((0, length, labels))
+        return text
+
+    def scrub(self, text, spans=None):
+        """Scrub one string, adding to the per-rule counts.
+
+        If spans is a list, (start, end, [rule labels]) is appended for each
+        scrubbed stretch of the input text.
+        """
+        if self.combined is None:
+            return self.scrub_in_turn(text, spans)
+
+        counts = list(self.counts)
+        mark = len(spans) if spans is not None else 0
+        try:
+            return self.scan(text, spans)
+        except NeedsSequential:
+            self.counts = counts
+            if spans is not None:
+                # Report where the rules match the original text rather than one span for all of it
+                del spans[mark:]
+                spans.extend((match.start(), match.end(), [self.rules[self.markers[match.lastindex]]['label']])
+                             for match in self.combined.finditer(text) if match.end() > match.start())
+            return self.scrub_in_turn(text)
+
+    def scan(self, text, spans):
+        pieces = []
+        position = 0
+        # (start, end, rule index) of each replacement in the output
+        replaced = []
+        length = 0
+        while True:
+            match = self.combined.search(text, position)
+            if match is None:
+                break
+            start, end = match.span()
+            if start == end:
+                raise NeedsSequential()
+            index = self.markers[match.lastindex]
+
+            if ((start > 0 and WORD_CHAR_RE.match(text, start - 1)) or WORD_CHAR_RE.match(text, end)
+                    or self.overlaps(index, text, start, end)):
+                # Replacing here changes what later rules see
+                raise NeedsSequential()
+            replacement = self.replacement(index, match)
+            if spans is not None:
+                spans.append((start, end, [self.rules[index]['label']]))
+
+            pieces.append(text[position:start])
+            pieces.append(replacement)
+            length += start - position
+            replaced.append((length, length + len(replacement), index))
+            length += len(replacement)
+            position = end
+
+        pieces.append(text[position:])
+        scrubbed = ''.join(pieces)
+        if self.crosses_replacement(scrubbed, replaced):
+            raise NeedsSequential()
+        return scrubbed
+
+    def changes(self):
+        """Describe what was scrubbed, one line per rule that matched, in rule order"""
+        return [rule['change'](count) for rule, count in zip(self.rules, self.counts) if count]
+
+# Comments, doctypes/processing instructions and tags; only comment bodies and some attribute values are scrubbed
+MARKUP_RE = re.compile(r"""<!--(.*?)(?:-->|$)|<[!?][^>]*>|<(/?)([A-Za-z][^\s/>]*)((?:[^>"']|"[^"]*"|'[^']*')*)>""", re.S)
+ATTRIBUTE_RE = re.compile(r"""([^\s"'>/=]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'=<>`]+))""")
+SCRUBBED_ATTRIBUTES = {'href', 'title', 'alt'}
+RAW_TEXT_TAGS = {'script', 'style'}
+
+# Joins text slots so they can be scrubbed in one scan; no pattern crosses it
+SLOT_SEPARATOR = '\x00'
+
+def find_scrub_slots(html):
+    """Yield (start, end, where) for each text node, comment and scrubbed attribute value in an HTML document"""
+    position = 0
+    while True:
+        markup = MARKUP_RE.search(html, position)
+        if markup is None:
+            break
+        if markup.start() > position:
+            yield position, markup.start(), 'text'
+        position = markup.end()
+
+        # Comments end up in the deployed page too
+        comment, closing, tag, _ = markup.groups()
+        if comment:
+            yield markup.start(1), markup.end(1), 'comment'
+        if tag is None or closing:
+            continue
+        for attribute in ATTRIBUTE_RE.finditer(html, markup.start(4), markup.end(4)):
+            name = attribute.group(1).lower()
+            if name in SCRUBBED_ATTRIBUTES:
+                value = next(group for group in (2, 3, 4) if attribute.group(group) is not None)
+                yield attribute.start(value), attribute.end(value), name
+
+        # Script and style contents are code, not text
+        if tag.lower() in RAW_TEXT_TAGS:
+            close = re.compile(f'</{tag}', re.IGNORECASE).search(html, position)
+            position = close.start() if close else len(html)
+
+    if position < len(html):
+        yield position, len(html), 'text'
+
+def scrub_html_dom(html, scrubber, spans=None):
+    """
+    Scrub only text nodes, comments and href/title/alt values, leaving markup untouched.
+
+    If spans is a list, (start, end, where, [rule labels]) is appended for each
+    scrubbed stretch, with offsets into html.
+    """
+    slots = list(find_scrub_slots(html))
+    values = [html[start:end] for start, end, _ in slots]
+
+    # Scrub every slot in one scan; fall back to slot by slot if a pattern crosses the separator
+    counts = list(scrubber.counts)
+    joined_spans = []
+    scrubbed = None
+    if not any(SLOT_SEPARATOR in value for value in values):
+        scrubbed = scrubber.scrub(SLOT_SEPARATOR.join(values), joined_spans).split(SLOT_SEPARATOR)
+        if len(scrubbed) != len(values):
+            scrubber.counts = counts
+            scrubbed = None
+
+    slot_spans = []
+    if scrubbed is None:
+        scrubbed = []
+        for index, value in enumerate(values):
+            value_spans = []
+            scrubbed.append(scrubber.scrub(value, value_spans))
+            slot_spans.extend((index, start, end, labels) for start, end, labels in value_spans)
+    else:
+        # Map offsets in the joined text back to (slot, offset in slot)
+        slot_offsets = []
+        offset = 0
+        for value in values:
+            slot_offsets.append(offset)
+            offset += len(value) + 1
+        for start, end, labels in joined_spans:
+            index = bisect.bisect_right(slot_offsets, start) - 1
+            slot_spans.append((index, start - slot_offsets[index], end - slot_offsets[index], labels))
+
+    if spans is not None:
+        for index, start, end, labels in slot_spans:
+            slot_start, _, where = slots[index]
+            spans.append((slot_start + start, slot_start + end, where, labels))
+
+    pieces = []
+    position = 0
+    for (start, end, _), value in zip(slots, scrubbed):
+        pieces.append(html[position:start])
+        pieces.append(value)
+        position = end
+    pieces.append(html[position:])
+    return ''.join(pieces)
+
+def scrub_pii_from_html(html_content, name_replacements, mode='regex', spans=None, single_pass=True):
     """
-    Scrub PII from HTML content using regex patterns.
+    Scrub PII from HTML content in a single pass over the document.
+
+    Args:
+        html_content: HTML string to scrub
+        name_replacements: Dict of regex patterns to replacement strings
+        mode: 'regex' to scrub the raw HTML, 'dom' to scrub only text, comments and href/title/alt values
+        spans: Optional list that receives (start, end, where, [rule labels]) for each scrubbed stretch
+        single_pass: False to apply the patterns one after another instead
+    """
+    scrubber = PIIScrubber(name_replacements, single_pass)
+    if mode == 'dom':
+        html_content = scrub_html_dom(html_content, scrubber, spans)
+    else:
+        raw_spans = [] if spans is not None else None
+        html_content = scrubber.scrub(html_content, raw_spans)
+        if spans is not None:
+            spans.extend((start, end, 'html', labels) for start, end, labels in raw_spans)
+    return html_content, scrubber.changes()
+
+def scrub_fragments(fragments, scrubber, mode='regex'):
+    """
+    Scrub an iterable of HTML fragments one at a time, for pages that are streamed to disk.
+
+    Fragments must split the page between elements (as generate_final.py's
+    sections do), since a pattern can't match across two fragments.
+    Counts accumulate in scrubber; read them with scrubber.changes().
+    """
+    for fragment in fragments:
+        if mode == 'dom':
+            yield scrub_html_dom(fragment, scrubber)
+        else:
+            yield scrubber.scrub(fragment)
+
+def span_locations(html, spans):
+    """Turn span offsets into (line, column, where, labels), both 1-based"""
+    line_starts = [0] + [match.end() for match in re.finditer('\n', html)]
+    locations = []
+    for start, _, where, labels in spans:
+        line = bisect.bisect_right(line_starts, start)
+        locations.append((line, start - line_starts[line - 1] + 1, where, labels))
+    return locations
+
+def scrub_pii_sequential(html_content, name_replacements):
+    """
+    Scrub PII by applying each pattern in turn (reference implementation for --verify).
 
     Args:
         html_content: HTML string to scrub
@@ -79,7 +451,100 @@ def scrub_pii_from_html(html_content, name_replacements):
 
     return html_content, changes_made
 
+# Inputs the single pass once scrubbed differently from pattern-by-pattern scrubbing,
+# as (name replacements, HTML); --self-test checks them in both modes
+SELF_TEST_CASES = [
+    # A glued name match left a phone number split across lines unscrubbed
+    ({'Smith': '[name]'}, '<p>Ask the Smiths or call 555 123\n4567 tonight</p>'),
+    ({'Smith': '[name]'}, '<p>Call 555 123\n4567 or ask the Smiths</p>'),
+    ({'Smith': '[name]'}, '<p title="Smiths 555.123\n4567">Smiths</p>'),
+    # An earlier rule matching inside a later one's match
+    ({'Smith': '[name]', 'smith@example': '[handle]'}, '<p>mail smith@example.com or call 555-123-4567</p>'),
+    # A later rule matching a replacement together with the text around it
+    ({'Bob': 'Robert', 'Robert Smith': '[player]'}, '<p>Bob Smith and Robert Smith</p>'),
+    ({'Smith': 'S', 'S Jones': 'SJ'}, '<p>Smith Jones</p>'),
+    ({'Jane': '[name]', '\\[name\\] Roe': '[p2]'}, '<p>Jane Roe</p>'),
+]
+
+def self_test():
+    """Scrub SELF_TEST_CASES both ways and report any difference, returning whether all matched"""
+    failures = 0
+    for name_replacements, html in SELF_TEST_CASES:
+        for mode in ('regex', 'dom'):
+            result = scrub_pii_from_html(html, name_replacements, mode)
+            if mode == 'dom':
+                expected = scrub_pii_from_html(html, name_replacements, mode, single_pass=False)
+            else:
+                expected = scrub_pii_sequential(html, name_replacements)
+            if result != expected:
+                failures += 1
+                print(f"FAILED ({mode} mode): {html!r}\n   got      {result[0]!r}\n   expected {expected[0]!r}")
+    print(f"{len(SELF_TEST_CASES) * 2 - failures} of {len(SELF_TEST_CASES) * 2} self-test case(s) passed")
+    return failures == 0
+
+def rename_section_file(path):
+    """Rename a scrubbed section file after its new contents, as generate_final.py names them, returning the new name.
+
+    Section files are served as never changing, so scrubbed contents under the
+    old name could be taken for the unscrubbed ones, or the other way round.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        name = hashed_name(f.read(), '.html')
+    new_path = os.path.join(os.path.dirname(path), name)
+    if new_path != path:
+        os.replace(path, new_path)
+    return name
+
+def scrub_page(path, name_replacements, args, renames=None):
+    """Scrub one deployed HTML file in place, returning (changes, span locations, bytes before, bytes after).
+
+    renames maps section file names to the names links to them should use instead.
+    """
+    print(f"Reading {path}...")
+
+    with open(path, 'r', encoding='utf-8') as f:
+        original_content = f.read()
+    if renames:
+        original_content = SECTION_LINK_RE.sub(
+            lambda match: 'sections/' + renames.get(match.group(1), match.group(1)), original_content)
+
+    # Apply scrubbing
+    spans = []
+    cleaned_content, changes = scrub_pii_from_html(original_content, name_replacements, args.mode, spans)
+
+    if args.verify:
+        if args.mode == 'dom':
+            expected_content, expected_changes = scrub_pii_from_html(
+                original_content, name_replacements, args.mode, single_pass=False)
+        else:
+            expected_content, expected_changes = scrub_pii_sequential(original_content, name_replacements)
+        if expected_content == cleaned_content and expected_changes == changes:
+            print("Verified: single-pass result matches pattern-by-pattern scrubbing")
+        else:
+            print("WARNING: single-pass result differs from pattern-by-pattern scrubbing (overlapping patterns?)")
+            print("         Using the pattern-by-pattern result.")
+            cleaned_content, changes = expected_content, expected_changes
+
+    # Write back, replacing the page only once the new version is complete
+    write_atomic(path, [cleaned_content])
+
+    return changes, span_locations(original_content, spans), len(original_content), len(cleaned_content)
+
 def main():
+    parser = argparse.ArgumentParser(description='Scrub PII from the public deployment.')
+    parser.add_argument('--mode', choices=['regex', 'dom'], default='regex',
+                        help="'regex' scrubs the raw HTML (default); 'dom' scrubs only text, comments and href/title/alt values")
+    parser.add_argument('--verify', action='store_true',
+                        help='also scrub pattern by pattern and check both methods give the same result')
+    parser.add_argument('--report', metavar='FILE',
+                        help='write the location of every scrubbed span to FILE as JSON')
+    parser.add_argument('--self-test', action='store_true',
+                        help='check the single pass against pattern-by-pattern scrubbing on known tricky inputs, then exit')
+    args = parser.parse_args()
+
+    if args.self_test:
+        raise SystemExit(0 if self_test() else 1)
+
     print("PII Scrubber for Campaign Chronicle\n")
 
     if not os.path.exists(PUBLIC_HTML):
@@ -95,33 +560,55 @@ def main():
         print("\nWARNING: No name replacements configured!")
         print("         Only email addresses and phone numbers will be scrubbed.\n")
 
-    print(f"Reading {PUBLIC_HTML}...")
-
-    # Method 1: Regex-based scrubbing
-    with open(PUBLIC_HTML, 'r', encoding='utf-8') as f:
-        original_content = f.read()
-
-    original_size = len(original_content)
-
-    # Apply scrubbing
-    cleaned_content, changes = scrub_pii_from_html(original_content, name_replacements)
+    # generate_final.py --split puts the sections in files of their own
+    sections = []
+    if os.path.isdir(PUBLIC_SECTIONS_DIR):
+        sections = [os.path.join(PUBLIC_SECTIONS_DIR, name)
+                    for name in sorted(os.listdir(PUBLIC_SECTIONS_DIR)) if name.endswith('.html')]
+    pages = [PUBLIC_HTML] + sections
 
-    # Write back
-    with open(PUBLIC_HTML, 'w', encoding='utf-8') as f:
-        f.write(cleaned_content)
-
-    final_size = len(cleaned_content)
+    # Section files are named after their contents, so scrubbed ones are renamed and the index relinked
+    results = {}
+    renames = {}
+    for path in sections:
+        results[path] = scrub_page(path, name_replacements, args)
+        name = rename_section_file(path)
+        if name != os.path.basename(path):
+            renames[os.path.basename(path)] = name
+    results = {PUBLIC_HTML: scrub_page(PUBLIC_HTML, name_replacements, args, renames), **results}
+    if renames:
+        print(f"Renamed {len(renames)} scrubbed section file(s) after their new contents")
+    # The search index and .gz/.br copies generate_final.py wrote are of the unscrubbed pages
+    write_search_index('public', SEARCH_CACHE)
+    precompress_deployment('public', PRECOMPRESS_MANIFEST)
+    original_size = sum(result[2] for result in results.values())
+    final_size = sum(result[3] for result in results.values())
     size_diff = original_size - final_size
 
     print(f"\nPII Scrubbing Complete!\n")
 
-    if changes:
+    if any(result[0] for result in results.values()):
         print("Changes made:")
-        for change in changes:
-            print(f"   - {change}")
+        for path, (changes, _, _, _) in results.items():
+            for change in changes:
+                print(f"   - {change}" + (f" ({path})" if len(pages) > 1 else ""))
     else:
         print("   No PII found - file is clean!")
 
+    locations = [(path, *location) for path, result in results.items() for location in result[1]]
+    if locations:
+        print(f"\nScrubbed {len(locations)} span(s) in {args.mode} mode:")
+        for path, line, column, where, labels in locations[:MAX_REPORTED_SPANS]:
+            print(f"   {path + ', ' if len(pages) > 1 else ''}line {line}, col {column} ({where}): {', '.join(labels)}")
+        if len(locations) > MAX_REPORTED_SPANS:
+            print(f"   ... and {len(locations) - MAX_REPORTED_SPANS} more" +
+                  ("" if args.report else " (use --report FILE for the full list)"))
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump([{'file': path, 'line': line, 'column': column, 'where': where, 'rules': labels}
+                       for path, line, column, where, labels in locations], f, indent=2)
+        print(f"   Span report written to {args.report}")
+
     print(f"\nStats:")
     print(f"   Original size: {original_size:,} bytes")
     print(f"   Final size:    {final_size:,} bytes")
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Full-text search index for the deployed campaign chronicle.
+Reads the sections out of the pages in public/ (after any PII scrubbing, so
+only what players can already see is indexed) and writes public/search-index.json:
+a sorted term list with, per term, the sections and word positions it occurs
+at. The page's search box fetches it on first use and answers queries, with
+prefix matching on the last word, without scanning the DOM.
+
+Sections are indexed incrementally: postings are cached by a hash of each
+section's HTML, so only sections that changed are tokenized again.
+
+Run directly to rebuild the index from public/ and benchmark its size and
+query latency.
+"""
+import argparse
+import gzip
+import hashlib
+import html
+import json
+import os
+import re
+import statistics
+import sys
+import time
+import unicodedata
+from bisect import bisect_left
+
+from atomic_write import write_atomic
+
+SEARCH_INDEX_FILENAME = 'search-index.json'
+INDEX_VERSION = 1
+# Bump whenever tokenization changes so cached postings are not reused
+TOKENIZER_VERSION = 2
+MAX_RESULTS = 20
+# Consecutive query words found next to each other count this much extra per occurrence
+PHRASE_BONUS = 10
+
+# Sections as generate_final.py renders them; placeholders of the split index carry data-src and are skipped
+SECTION_START_RE = re.compile(r'<div class="content-section" id="(section-(\d+))">')
+SECTION_END_RE = re.compile(r'<div class="content-section"|<div class="footer">|^        <script>', re.M)
+SECTION_TITLE_RE = re.compile(r'<h2 class="section-title">\s*<span class="section-number">\d+</span>(.*?)</h2>', re.S)
+HIDDEN_RE = re.compile(r'<(script|style)\b.*?</\1\s*>|<!--.*?-->', re.S | re.I)
+TAG_RE = re.compile(r'<[^>]*>')
+# Built on first use by token_re()
+TOKEN_RE = None
+
+def token_re():
+    """Match the page script's /[\\p{L}\\p{M}\\p{N}_]+/u.
+
+    \\w covers letters, digits and the underscore but not combining marks
+    (category M), so a word like "naïve" typed with a combining diaeresis
+    would split in two. The marks are added as ranges, listed from unicodedata.
+    """
+    global TOKEN_RE
+    if TOKEN_RE is None:
+        ranges = []
+        for code in range(sys.maxunicode + 1):
+            if unicodedata.category(chr(code)).startswith('M'):
+                if ranges and ranges[-1][1] == code - 1:
+                    ranges[-1][1] = code
+                else:
+                    ranges.append([code, code])
+        marks = ''.join(f'\\U{start:08x}-\\U{end:08x}' for start, end in ranges)
+        TOKEN_RE = re.compile(f'[\\w{marks}]+')
+    return TOKEN_RE
+
+def tokenize(text):
+    """Split text into lowercase words, composed (NFC) the same way the page script composes queries"""
+    return token_re().findall(unicodedata.normalize('NFC', text).lower())
+
+def html_text(fragment):
+    """Return the visible text of an HTML fragment"""
+    return html.unescape(TAG_RE.sub(' ', HIDDEN_RE.sub(' ', fragment)))
+
+def page_sections(content):
+    """Yield (section id, number, title, html) for every rendered section in a page"""
+    for match in SECTION_START_RE.finditer(content):
+        end = SECTION_END_RE.search(content, match.end())
+        # Trailing whitespace depends on what follows the section, so leave it out of the hash
+        section_html = content[match.start():end.start() if end else len(content)].rstrip()
+        title = SECTION_TITLE_RE.search(section_html)
+        title = ' '.join(html_text(title.group(1)).split()) if title else ''
+        yield match.group(1), int(match.group(2)), title, section_html
+
+def section_postings(section_html):
+    """Map each term of a section to the word positions it occurs at"""
+    postings = {}
+    for position, token in enumerate(tokenize(html_text(section_html))):
+        postings.setdefault(token, []).append(position)
+    return postings
+
+def deployed_pages(public_dir):
+    """The index page and, for a split build, its section files"""
+    pages = [os.path.join(public_dir, 'index.html')]
+    sections_dir = os.path.join(public_dir, 'sections')
+    if os.path.isdir(sections_dir):
+        pages += [os.path.join(sections_dir, name) for name in sorted(os.listdir(sections_dir))
+                  if name.endswith('.html')]
+    return pages
+
+def load_cache(cache_path):
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get('version') != TOKENIZER_VERSION:
+        return {}
+    return cache.get('sections', {})
+
+def build_index(public_dir, cache_path):
+    """Build the index structure from the deployed pages, returning (index, sections reindexed)"""
+    cached = load_cache(cache_path)
+    used = {}
+    sections = []
+    reindexed = 0
+    for page in deployed_pages(public_dir):
+        if not os.path.exists(page):
+            continue
+        with open(page, 'r', encoding='utf-8') as f:
+            content = f.read()
+        for section_id, number, title, section_html in page_sections(content):
+            digest = hashlib.sha256(section_html.encode('utf-8')).hexdigest()
+            postings = cached.get(digest)
+            if postings is None:
+                postings = section_postings(section_html)
+                reindexed += 1
+            used[digest] = postings
+            sections.append((number, section_id, title, postings))
+    sections.sort()
+
+    # Per term: a flat [section, count, position deltas..., section, count, ...] list
+    merged = {}
+    for doc, (_, _, _, postings) in enumerate(sections):
+        for term, positions in postings.items():
+            entry = merged.setdefault(term, [])
+            entry += [doc, len(positions), positions[0]]
+            entry += [b - a for a, b in zip(positions, positions[1:])]
+    terms = sorted(merged)
+    index = {
+        'version': INDEX_VERSION,
+        'sections': [[section_id, number, title] for number, section_id, title, _ in sections],
+        'terms': terms,
+        'postings': [merged[term] for term in terms]
+    }
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    write_atomic(cache_path, [json.dumps({'version': TOKENIZER_VERSION, 'sections': used}, separators=(',', ':'))])
+    return index, reindexed
+
+def write_search_index(public_dir, cache_path):
+    """Rebuild public/search-index.json from the deployed pages and print its size"""
+    index, reindexed = build_index(public_dir, cache_path)
+    data = json.dumps(index, separators=(',', ':'), ensure_ascii=False)
+    write_atomic(os.path.join(public_dir, SEARCH_INDEX_FILENAME), [data])
+    encoded = data.encode('utf-8')
+    print(f"Search index: {len(index['sections'])} sections ({reindexed} reindexed), {len(index['terms']):,} terms, "
+          f"{len(encoded) / 1024:.0f} KB ({len(gzip.compress(encoded)) / 1024:.0f} KB gzipped)")
+    return index
+
+def decode_postings(postings):
+    """Turn a flat postings list back into {section: [positions]}"""
+    sections = {}
+    i = 0
+    while i < len(postings):
+        doc, count = postings[i], postings[i + 1]
+        positions = []
+        position = 0
+        for delta in postings[i + 2:i + 2 + count]:
+            position += delta
+            positions.append(position)
+        sections[doc] = positions
+        i += 2 + count
+    return sections
+
+def search(index, query, limit=MAX_RESULTS):
+    """Answer a query the way the page script does, returning [(section id, number, title, score, matches)]"""
+    words = tokenize(query)
+    if not words:
+        return []
+    terms = index['terms']
+
+    matches = []
+    for i, word in enumerate(words):
+        # The word being typed matches as a prefix
+        if i == len(words) - 1:
+            start = bisect_left(terms, word)
+            end = start
+            while end < len(terms) and terms[end].startswith(word):
+                end += 1
+        else:
+            start = bisect_left(terms, word)
+            end = start + 1 if start < len(terms) and terms[start] == word else start
+        word_matches = {}
+        for term in range(start, end):
+            for doc, positions in decode_postings(index['postings'][term]).items():
+                word_matches.setdefault(doc, set()).update(positions)
+        if not word_matches:
+            return []
+        matches.append(word_matches)
+
+    hits = []
+    for doc in set.intersection(*(set(word_matches) for word_matches in matches)):
+        score = count = sum(len(word_matches[doc]) for word_matches in matches)
+        if len(matches) > 1:
+            for position in matches[0][doc]:
+                if all(position + offset in word_matches[doc] for offset, word_matches in enumerate(matches)):
+                    score += PHRASE_BONUS
+        hits.append((-score, doc, count))
+    hits.sort()
+    return [tuple(index['sections'][doc]) + (-score, count) for score, doc, count in hits[:limit]]
+
+def benchmark(index, rounds):
+    """Time typical queries against the index: single words, prefixes and two-word phrases"""
+    terms = index['terms']
+    step = max(1, len(terms) // 50)
+    samples = terms[::step]
+    queries = samples + [term[:3] for term in samples if len(term) > 3]
+    queries += [f'{a} {b}' for a, b in zip(samples, samples[1:])]
+
+    timings = []
+    for _ in range(rounds):
+        for query in queries:
+            started = time.perf_counter()
+            search(index, query)
+            timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    print(f"Queries: {len(queries)} x {rounds} rounds, "
+          f"median {statistics.median(timings):.3f} ms, p95 {timings[int(len(timings) * 0.95)]:.3f} ms, "
+          f"max {timings[-1]:.3f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the chronicle search index from public/.')
+    parser.add_argument('--public', default='public', help='deployment directory (default: public)')
+    parser.add_argument('--cache', default=os.path.join('cleaned_emails', '.cache', 'search.json'),
+                        help='section postings cache (default: %(default)s)')
+    parser.add_argument('--benchmark', action='store_true', help='also time a full rebuild and sample queries')
+    parser.add_argument('--rounds', type=int, default=20, help='benchmark rounds (default: 20)')
+    parser.add_argument('query', nargs='?', help='search the index and print the hits')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    index = write_search_index(args.public, args.cache)
+    print(f"Built in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    if args.benchmark:
+        os.remove(args.cache)
+        started = time.perf_counter()
+        build_index(args.public, args.cache)
+        print(f"Full rebuild without cache: {(time.perf_counter() - started) * 1000:.0f} ms")
+        benchmark(index, args.rounds)
+
+    if args.query:
+        for section_id, number, title, score, count in search(index, args.query):
+            print(f"  {number:>3}  {title}  ({count} matches, score {score})")
+
+if __name__ == '__main__':
+    main()
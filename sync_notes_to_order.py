@@ -1,6 +1,7 @@
-import json
 import os
-from bs4 import BeautifulSoup
+
+from content_order import order_journal
+from parsing import NOTES, parse
 
 # CONFIGURATION
 PLAYER_NOTES_HTML = 'player_notes.html'
@@ -13,7 +14,7 @@ def extract_notes_from_html(html_file):
         return []
 
     with open(html_file, 'r', encoding='utf-8') as f:
-        soup = BeautifulSoup(f.read(), 'html.parser')
+        soup = parse(f.read(), NOTES)
 
     notes = []
     for card in soup.find_all('div', class_='note'):
@@ -45,13 +46,13 @@ def sync_notes_to_content_order():
 
     print(f"Found {len(html_notes)} notes in {PLAYER_NOTES_HTML}")
 
-    # Load existing content_order.json
-    if not os.path.exists(CONTENT_ORDER_JSON):
+    # Load existing content_order.json, with any edits the organizer has logged
+    journal = order_journal(CONTENT_ORDER_JSON)
+    if not journal.exists():
         print(f"Error: {CONTENT_ORDER_JSON} not found")
         return
 
-    with open(CONTENT_ORDER_JSON, 'r', encoding='utf-8') as f:
-        content_order = json.load(f)
+    content_order = journal.read()
 
     # Get existing note IDs
     existing_note_ids = set()
@@ -74,6 +75,7 @@ def sync_notes_to_content_order():
     print(f"\nFound {len(new_notes)} new note(s) to add:")
 
     # Append new notes to content_order
+    ops = []
     for note in new_notes:
         new_entry = {
             "filename": f"player_notes.html#{note['note_id']}",
@@ -84,12 +86,12 @@ def sync_notes_to_content_order():
             "note_id": note['note_id'],
             "excluded": False
         }
-        content_order['items'].append(new_entry)
+        ops.append({'op': 'insert', 'item': new_entry})
         print(f"  + {note['title']} ({note['note_id']})")
 
     # Write updated content_order.json
-    with open(CONTENT_ORDER_JSON, 'w', encoding='utf-8') as f:
-        json.dump(content_order, f, indent=2, ensure_ascii=False)
+    journal.apply(ops)
+    journal.compact()
 
     print(f"\n✓ Successfully added {len(new_notes)} new note(s) to {CONTENT_ORDER_JSON}")
     print(f"  New notes appended at the end - run your organizer to reorder if needed")
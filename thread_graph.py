@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Conversation threading for clean_emails.py, after Jamie Zawinski's algorithm
+(https://www.jwz.org/doc/threading.html).
+Every Message-ID, and every ID named in a References or In-Reply-To header,
+gets a node in an index, and each message hangs under the last message it
+refers to. Messages whose parent is missing from the archive stay connected
+through an empty node for that ID. The trees left at the top are then joined
+by their subject with any number of Re:/Fwd: prefixes stripped, so replies
+from clients that drop References still find their thread.
+
+thread_by_subject() is the older grouping clean_emails.py keeps as its
+default: one thread per subject with a single Re:/Fwd:/FW: prefix removed.
+
+Headers win over subjects: a reply stays in the thread it refers to even if it
+was renamed, or if another thread has the same subject. Building the graph is
+linear in the number of messages and references: the walk up the tree that
+keeps a link from closing a loop is only needed for a message that arrives
+after its replies.
+"""
+import re
+
+# Reply and forward markers, as many as there are: "Re: Fwd: RE[2]: ..."
+PREFIX_RE = re.compile(r'^(?:\s*(?:re|fwd?|fw|aw|sv)\s*(?:\[\d+\]|\(\d+\))?\s*:)+\s*', re.IGNORECASE)
+# The one prefix subject grouping removes
+SINGLE_PREFIX_RE = re.compile(r'^(Re|Fwd|FW):\s+', re.IGNORECASE)
+MESSAGE_ID_RE = re.compile(r'<([^<>\s]+)>')
+WHITESPACE_RE = re.compile(r'\s+')
+
+def message_ids(value):
+    """Return the message IDs in a Message-ID, In-Reply-To or References header, in order, without brackets"""
+    if not value:
+        return []
+    value = str(value)
+    ids = MESSAGE_ID_RE.findall(value)
+    if not ids and value.strip() and not any(c.isspace() for c in value.strip()):
+        # A bare ID some clients write without the angle brackets
+        ids = [value.strip()]
+    return ids
+
+def parent_ids(references, in_reply_to):
+    """The ancestry of a message, oldest first: its References, ending with what it replies to"""
+    ids = message_ids(references)
+    replied = message_ids(in_reply_to)
+    if replied and (not ids or ids[-1] != replied[0]):
+        ids.append(replied[0])
+    return ids
+
+def base_subject(subject):
+    """Return a subject without its reply/forward prefixes"""
+    return PREFIX_RE.sub('', subject or '', count=1).strip()
+
+def subject_key(subject):
+    """Subjects that differ only in case or spacing belong together"""
+    return WHITESPACE_RE.sub(' ', subject).casefold()
+
+class Node:
+    """A message, or an empty placeholder for an ID only seen in other messages' headers"""
+    __slots__ = ('message', 'parent', 'has_children')
+
+    def __init__(self, message=None):
+        self.message = message
+        self.parent = None
+        # Whether anything was ever linked under this node; a node without children can't close a loop
+        self.has_children = False
+
+    def has_ancestor(self, node):
+        """Is node this one or above it?"""
+        current = self
+        while current is not None:
+            if current is node:
+                return True
+            current = current.parent
+        return False
+
+    def can_adopt(self, child):
+        """Would linking child under this node keep the graph a forest?"""
+        return child is not self and not (child.has_children and self.has_ancestor(child))
+
+    def adopt(self, child):
+        child.parent = self
+        self.has_children = True
+
+def build_graph(messages):
+    """Index the messages by ID and link each under its parent, returning a node per message.
+
+    messages is a list of (key, message ID, parent IDs, subject, date).
+    """
+    by_id = {}
+    nodes = []
+
+    def node_for(message_id):
+        node = by_id.get(message_id)
+        if node is None:
+            node = by_id[message_id] = Node()
+        return node
+
+    for position, (_, message_id, parents, _, _) in enumerate(messages):
+        node = by_id.get(message_id) if message_id else None
+        if node is None or node.message is not None:
+            # A second copy of an ID gets a node of its own, outside the index
+            node = Node(position)
+            if message_id and message_id not in by_id:
+                by_id[message_id] = node
+        else:
+            node.message = position
+        nodes.append(node)
+
+        # Chain the references, keeping links made by earlier messages
+        previous = None
+        for parent_id in parents:
+            current = node_for(parent_id)
+            if previous is not None and current.parent is None and previous.can_adopt(current):
+                previous.adopt(current)
+            previous = current
+
+        # The message's own headers have the last word on its parent, over what others presumed
+        node.parent = None
+        if previous is not None and previous.can_adopt(node):
+            previous.adopt(node)
+    return nodes
+
+def thread_messages(messages):
+    """Group messages into threads.
+
+    messages is a list of (key, message ID, parent IDs, subject, date) in the
+    order they were read. Returns [(subject, [(key, date)])], threads in the
+    order their first message was read and each thread's messages in read
+    order. A thread's subject is the topmost message's of its first tree, without prefixes.
+    """
+    nodes = build_graph(messages)
+
+    # Find each message's root and how deep under it it sits, sharing the walk up
+    roots = {}
+    depths = {}
+    trees = {}
+    for position, node in enumerate(nodes):
+        path = []
+        current = node
+        while current.parent is not None and current not in roots:
+            path.append(current)
+            current = current.parent
+        root = roots.get(current, current)
+        depth = depths.get(current, 0)
+        for step in reversed(path):
+            depth += 1
+            roots[step] = root
+            depths[step] = depth
+        roots.setdefault(current, root)
+        depths.setdefault(current, 0)
+        trees.setdefault(root, []).append(position)
+
+    # Describe each tree by its topmost message (the earliest, if several are equally high)
+    threads = []
+    for positions in trees.values():
+        top = min(positions, key=lambda position: (depths[nodes[position]], position))
+        threads.append({'subject': base_subject(messages[top][3]), 'positions': positions})
+
+    # Join the trees that share a subject, under the subject of the first one read
+    by_subject = {}
+    for thread in threads:
+        if not thread['subject']:
+            continue
+        target = by_subject.setdefault(subject_key(thread['subject']), thread)
+        if target is not thread:
+            target['positions'].extend(thread['positions'])
+            thread['positions'] = None
+
+    grouped = []
+    for thread in threads:
+        if thread['positions'] is None:
+            continue
+        positions = sorted(thread['positions'])
+        grouped.append((positions[0], thread['subject'], [(messages[p][0], messages[p][4]) for p in positions]))
+    grouped.sort(key=lambda thread: thread[0])
+    return [(subject, entries) for _, subject, entries in grouped]
+
+def thread_by_subject(messages):
+    """Group messages by subject alone, taking the same list and returning the same shape as thread_messages().
+
+    A thread is every message whose subject is the same once one Re:/Fwd:/FW:
+    prefix is removed, so "Re: Re:" replies and renamed replies start threads of their own.
+    """
+    threads = {}
+    for key, _, _, subject, date in messages:
+        threads.setdefault(SINGLE_PREFIX_RE.sub('', subject or '').strip(), []).append((key, date))
+    return list(threads.items())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Metadata index of the thread files in cleaned_emails/.
+clean_emails.py records each thread it writes (title, first date, message
+count, size, content hash) in threads.json, so organize_server.py can list
+threads without opening every file. Files the index doesn't know about, or that
+changed since it was written, are described on the fly.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+
+INDEX_FILENAME = 'threads.json'
+INDEX_VERSION = 1
+
+# Card headers carry the message date as <small>date</small>
+DATE_RE = re.compile(r'<small>([^<]+)</small>')
+CARD_RE = re.compile(r'<div class="card[ "]')
+
+def is_thread_file(filename):
+    return filename.endswith('.html') and filename != 'index.html'
+
+def describe_thread(filename, content, stat):
+    """Build the index entry for a thread file from its text and os.stat result"""
+    date = DATE_RE.search(content)
+    return {
+        'filename': filename,
+        'title': filename.replace('.html', '').replace('_', ' '),
+        'date': date.group(1) if date else None,
+        'messages': len(CARD_RE.findall(content)),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': hashlib.sha256(content.encode('utf-8')).hexdigest()
+    }
+
+class ThreadIndex:
+    """threads.json entries for a directory of thread files, revalidated when the directory changes"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, INDEX_FILENAME)
+        self.threads = {}
+        self.signature = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Read threads.json, ignoring it if missing or from another version"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('version') != INDEX_VERSION:
+            return {}
+        return data.get('threads', {})
+
+    def save(self):
+        """Write threads.json atomically"""
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'version': INDEX_VERSION, 'threads': self.threads}, f, indent=2, sort_keys=True)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, self.path)
+
+    def put(self, filename, content):
+        """Record a thread file that was just written with this content"""
+        stat = os.stat(os.path.join(self.directory, filename))
+        self.threads[filename] = describe_thread(filename, content, stat)
+
+    def refresh(self, known):
+        """Sync entries with the directory listing, re-describing only files whose size or mtime changed"""
+        threads = {}
+        for filename in os.listdir(self.directory):
+            if not is_thread_file(filename):
+                continue
+            filepath = os.path.join(self.directory, filename)
+            stat = os.stat(filepath)
+            entry = known.get(filename)
+            if entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    entry = describe_thread(filename, f.read(), stat)
+            threads[filename] = entry
+        self.threads = threads
+
+    def entries(self):
+        """Return the current entries, rescanning only when the directory or threads.json changed.
+
+        Creating, deleting or renaming a thread file changes the directory's mtime,
+        and clean_emails.py replaces threads.json after every run, which covers
+        files it rewrote in place.
+        """
+        with self.lock:
+            try:
+                index_mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                index_mtime = None
+            signature = (os.stat(self.directory).st_mtime_ns, index_mtime)
+            if signature != self.signature:
+                # Entries are checked against each file's size and mtime, so merging is safe
+                self.refresh({**self.load(), **self.threads})
+                self.signature = signature
+            return list(self.threads.values())
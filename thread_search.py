@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Full-text search over the cleaned threads and player notes for organize_server.py.
+Every message card and note is stored in an SQLite FTS5 table in
+cleaned_emails/.cache/, so searching is a single indexed query instead of a
+BeautifulSoup parse per file. Only files whose size or mtime changed since they
+were indexed are parsed again.
+"""
+import html
+import os
+import re
+import sqlite3
+import threading
+
+from parsing import CARDS, NOTES, parse
+from thread_index import INDEX_FILENAME, is_thread_file
+
+# Bump whenever the tables below or the card extraction change
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS cards USING fts5(
+    path UNINDEXED,
+    filename UNINDEXED,
+    position UNINDEXED,
+    date UNINDEXED,
+    title,
+    body,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+'''
+
+TABLES = ['meta', 'files', 'cards']
+
+# bm25() takes a weight per column, unindexed ones included; a hit in the title counts more
+RANK_WEIGHTS = '0, 0, 0, 0, 5.0, 1.0'
+SNIPPET_TOKENS = 16
+MAX_HITS = 50
+# Snippet highlight markers that can't occur in card text, swapped for <mark> after escaping
+MARK_START = '\ue000'
+MARK_END = '\ue001'
+
+WORD_RE = re.compile(r'\w+')
+
+def thread_cards(filename, content):
+    """Return (filename, position, date, title, text) for each message card of a thread file"""
+    soup = parse(content, CARDS)
+    title = filename.replace('.html', '').replace('_', ' ')
+    cards = []
+    for idx, card in enumerate(soup.find_all('div', class_='card')):
+        header = card.find('div', class_='card-header')
+        date_elem = header.find('small') if header else None
+        body = card.find('div', class_='card-body')
+        cards.append((
+            filename,
+            idx,
+            date_elem.get_text(strip=True) if date_elem else None,
+            title,
+            body.get_text(' ', strip=True) if body else ''
+        ))
+    return cards
+
+def note_cards(filename, content):
+    """Return (item filename, position, date, title, text) for each note of player_notes.html"""
+    soup = parse(content, NOTES)
+    cards = []
+    for idx, note_div in enumerate(soup.find_all('div', class_='note')):
+        header = note_div.find('div', class_='card-header')
+        title_elem = header.find('h5') if header else None
+        content_div = note_div.find('div', class_='note-content')
+        note_id = content_div.get('id') if content_div else f'note-{idx}'
+        cards.append((
+            f'{filename}#{note_id}',
+            idx,
+            None,
+            title_elem.get_text(strip=True) if title_elem else f'Note {idx + 1}',
+            content_div.get_text(' ', strip=True) if content_div else ''
+        ))
+    return cards
+
+def match_expression(query):
+    """Turn free text into an FTS5 query: every word must occur, the last one as a prefix"""
+    words = WORD_RE.findall(query)
+    if not words:
+        return None
+    # Quoting keeps words like AND/OR/NEAR and stray operators literal
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+class ThreadSearch:
+    """FTS5 index of the cards in a directory of thread files plus the player notes file"""
+
+    def __init__(self, db_path, directory, notes_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.directory = directory
+        self.notes_path = notes_path
+        self.signature = None
+        self.lock = threading.Lock()
+        # Shared by the server's threads; every use holds self.lock
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        try:
+            self.create_schema()
+        except sqlite3.Error:
+            # e.g. "no such module: fts5", or a read-only database
+            self.conn.close()
+            raise
+
+    def create_schema(self):
+        """Create the tables, dropping those of an older schema version first"""
+        try:
+            row = self.conn.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        if row is None or row[0] != str(SCHEMA_VERSION):
+            with self.conn:
+                for table in TABLES:
+                    self.conn.execute(f'DROP TABLE IF EXISTS {table}')
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(SCHEMA_VERSION),))
+
+    def sources(self):
+        """Return {path: (filename, card extractor)} for every file that should be indexed"""
+        sources = {}
+        for filename in os.listdir(self.directory):
+            if is_thread_file(filename):
+                sources[os.path.join(self.directory, filename)] = (filename, thread_cards)
+        if os.path.exists(self.notes_path):
+            sources[self.notes_path] = (os.path.basename(self.notes_path), note_cards)
+        return sources
+
+    def refresh(self):
+        """Re-index files that were added, changed or removed since they were last indexed.
+
+        Returns the number of files (re)indexed or dropped.
+        """
+        indexed = {path: (size, mtime_ns) for path, size, mtime_ns in self.conn.execute('SELECT * FROM files')}
+        changed = 0
+        with self.conn:
+            for path, (filename, extract) in self.sources().items():
+                stat = os.stat(path)
+                if indexed.pop(path, None) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                with open(path, 'r', encoding='utf-8') as f:
+                    cards = extract(filename, f.read())
+                self.conn.execute('DELETE FROM cards WHERE path = ?', (path,))
+                self.conn.executemany('INSERT INTO cards (path, filename, position, date, title, body) VALUES (?, ?, ?, ?, ?, ?)',
+                                      [(path,) + card for card in cards])
+                self.conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?)', (path, stat.st_size, stat.st_mtime_ns))
+                changed += 1
+            for path in indexed:
+                self.conn.execute('DELETE FROM cards WHERE path = ?', (path,))
+                self.conn.execute('DELETE FROM files WHERE path = ?', (path,))
+                changed += 1
+        return changed
+
+    def current_signature(self):
+        """Stat what changes when thread files or notes are written; see ThreadIndex.entries()"""
+        def mtime(path):
+            try:
+                return os.stat(path).st_mtime_ns
+            except OSError:
+                return None
+        return (mtime(self.directory), mtime(os.path.join(self.directory, INDEX_FILENAME)), mtime(self.notes_path))
+
+    def search(self, query, limit=MAX_HITS):
+        """Return ranked hits for query, best first, with an HTML-escaped snippet around the matched words"""
+        expression = match_expression(query)
+        if expression is None:
+            return []
+        with self.lock:
+            signature = self.current_signature()
+            if signature != self.signature:
+                self.refresh()
+                self.signature = signature
+            rows = self.conn.execute(
+                f'''SELECT filename, position, date, title,
+                           snippet(cards, 5, ?, ?, '…', {SNIPPET_TOKENS}),
+                           bm25(cards, {RANK_WEIGHTS}) AS score
+                    FROM cards WHERE cards MATCH ? ORDER BY score LIMIT ?''',
+                (MARK_START, MARK_END, expression, limit)).fetchall()
+
+        return [{
+            'filename': filename,
+            'index': position,
+            'date': date,
+            'title': title,
+            'snippet': html.escape(snippet).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'),
+            'score': round(-score, 3)
+        } for filename, position, date, title, snippet, score in rows]